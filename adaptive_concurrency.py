@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Control adaptativo de concurrencia (AIMD) para las llamadas al API de OCR
+Al estilo del control de congestión de TCP:
+    - incremento aditivo del límite de peticiones en vuelo mientras la latencia se mantiene estable
+    - reducción multiplicativa ante 429, timeouts, respuestas vacías o un aumento de la latencia
+      respecto a la latencia sin carga
+Cada ventana (tantas peticiones como el límite, como un RTT en TCP, y al menos dos RTT con
+límites bajos) se resume con la latencia media, que por la ley de Little refleja la cola aunque
+solo espere una parte de las peticiones. La latencia sin carga es la mínima, entre los límites
+usados en los últimos baseline_seconds, de la media de todas las ventanas con ese límite: agrupar
+por límite absorbe la variación entre documentos y el mínimo no sube con la cola, así que el
+límite no crece indefinidamente aunque la latencia aumente poco a poco. El límite sube como mucho
+en 1 por ventana y cada ventana solo usa peticiones admitidas con el límite vigente, después de
+un primer RTT en el que se forma la cola, de modo que cada subida se mide antes de la siguiente.
+Tras una reducción se espera una ventana estable más antes de volver a subir. Cada reducción vacía la cola y vuelve a medir la
+latencia sin carga dentro de la ventana de tiempo.
+
+Simulación contra un servicio local con limitación:
+    python adaptive_concurrency.py --simulate
+"""
+
+import argparse
+import heapq
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# Añadir src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from ocr_response import get_pages
+
+OUTCOMES = ("success", "no_response", "throttled", "timeout", "error")
+# Una respuesta vacía más rápida que esta fracción de la latencia sin carga no es saturación
+FAST_FAILURE_RATIO = 0.5
+
+
+def classify_exception(error: Exception) -> str:
+    """Clasifica una excepción del cliente HTTP/SDK como 'throttled', 'timeout' o 'error'"""
+    status_code = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status_code is None and response is not None:
+        status_code = getattr(response, "status_code", None)
+
+    if status_code == 429 or "429" in str(error) or "rate limit" in str(error).lower():
+        return "throttled"
+    if isinstance(error, TimeoutError) or "timeout" in type(error).__name__.lower():
+        return "timeout"
+    return "error"
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Límite de peticiones en vuelo que se ajusta con AIMD según latencia y errores de saturación.
+    El procesador del proyecto captura los errores del API y devuelve None, así que por defecto
+    una respuesta vacía ('no_response') también se trata como señal de saturación
+    (none_is_congestion=False para procesadores que propagan los 429 y timeouts). Una respuesta
+    vacía mucho más rápida que la latencia sin carga (archivo ilegible, error de validación)
+    cuenta como error normal y no reduce el límite.
+    """
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 64,
+                 backoff_ratio: float = 0.7, latency_tolerance: float = 1.25,
+                 min_window_samples: int = 10, baseline_seconds: float = 60.0,
+                 min_backoff_seconds: float = 0.25, none_is_congestion: bool = True, history: int = 200):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.min_window_samples = min_window_samples
+        self.baseline_seconds = baseline_seconds
+        self.min_backoff_seconds = min_backoff_seconds
+        self.none_is_congestion = none_is_congestion
+
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.inflight = 0
+        self.window_latency: Optional[float] = None
+        self._window: List[float] = []
+        self._windows: Deque[Tuple[float, int, float, int]] = deque()   # (instante, límite, media, muestras)
+        self._baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self._epoch = 0   # cambia con cada ajuste del límite
+        self._warmup = 0  # muestras que se descartan tras un ajuste (un RTT)
+        self._hold = 0    # ventanas estables sin subir tras una reducción
+
+        self.counters = {outcome: 0 for outcome in OUTCOMES}
+        self.counters.update({"increases": 0, "decreases": 0})
+        self.decisions: Deque[Dict[str, Any]] = deque(maxlen=history)
+
+        self._condition = threading.Condition()
+
+    @property
+    def current_limit(self) -> int:
+        """Límite entero vigente"""
+        return int(self.limit)
+
+    @property
+    def baseline_latency(self) -> Optional[float]:
+        """Latencia sin carga: mínima latencia media por límite de los últimos baseline_seconds"""
+        return self._baseline
+
+    def acquire(self) -> int:
+        """Espera hasta que haya hueco bajo el límite actual; devuelve la época del límite para release()"""
+        with self._condition:
+            while self.inflight >= self.current_limit:
+                self._condition.wait()
+            self.inflight += 1
+            return self._epoch
+
+    def release(self, latency: float, outcome: str = "success", epoch: Optional[int] = None):
+        """
+        Libera un hueco y ajusta el límite según el resultado de la petición.
+        La latencia de una petición admitida antes del último ajuste (epoch distinta) no entra
+        en la ventana, porque refleja el límite anterior.
+        """
+        with self._condition:
+            self.inflight -= 1
+            baseline = self.baseline_latency
+            if outcome == "no_response" and baseline and latency < baseline * FAST_FAILURE_RATIO:
+                outcome = "error"
+            self.counters[outcome] += 1
+
+            if outcome == "success":
+                if epoch is None or epoch == self._epoch:
+                    self._on_success(latency)
+            elif outcome in ("throttled", "timeout") or (outcome == "no_response" and self.none_is_congestion):
+                self._decrease(outcome)
+
+            # Solo se despiertan tantos hilos como huecos libres (evita despertar a todos en cada respuesta)
+            self._condition.notify(max(self.current_limit - self.inflight, 0))
+
+    def _window_size(self) -> int:
+        """Muestras por ventana: un RTT (límite), con mínimo de dos RTT o min_window_samples"""
+        limit = self.current_limit
+        return max(limit, min(self.min_window_samples, 2 * limit))
+
+    def _on_success(self, latency: float):
+        if self._warmup:
+            self._warmup -= 1
+            return
+        self._window.append(latency)
+        if len(self._window) < self._window_size():
+            return
+
+        self._close_window()
+        baseline = self.baseline_latency
+        gradient = self.window_latency / baseline if baseline else 1.0
+        if gradient > self.latency_tolerance:
+            self._decrease(f"latency_gradient={gradient:.2f}")
+        elif self._hold:
+            self._hold -= 1
+        elif self.inflight + 1 >= self.current_limit * 0.8:
+            # Solo se sube si el límite se está usando; +1 por ventana (como TCP por RTT)
+            old_limit = self.limit
+            self.limit = min(self.max_limit, self.limit + 1)
+            self._start_epoch()
+            if int(self.limit) > int(old_limit):
+                self.counters["increases"] += 1
+                self._record("increase", old_limit, f"latency_gradient={gradient:.2f}")
+
+    def _start_epoch(self):
+        """Empieza a medir el límite recién ajustado: las latencias anteriores ya no le corresponden"""
+        self._epoch += 1
+        self._window = []
+        self._warmup = self.current_limit
+
+    def _close_window(self):
+        """Cierra la ventana de latencias actual y actualiza la latencia sin carga"""
+        now = time.monotonic()
+        self.window_latency = statistics.fmean(self._window)
+        self._windows.append((now, self.current_limit, self.window_latency, len(self._window)))
+        self._window = []
+        while self._windows[0][0] < now - self.baseline_seconds:
+            self._windows.popleft()
+
+        totals: Dict[int, List[float]] = {}
+        for _, limit, latency, samples in self._windows:
+            total = totals.setdefault(limit, [0.0, 0])
+            total[0] += latency * samples
+            total[1] += samples
+        # Un límite con pocas muestras daría una media ruidosa y el mínimo se quedaría con la más baja
+        reliable = [latency / samples for latency, samples in totals.values()
+                    if samples >= 3 * self.min_window_samples]
+        self._baseline = min(reliable or [latency / samples for latency, samples in totals.values()])
+
+    def _decrease(self, reason: str):
+        # Una sola reducción por ventana de latencia: las peticiones que ya estaban en vuelo
+        # reflejan el límite anterior y no deben volver a reducirlo. Antes de la primera
+        # medición se usa una ventana mínima fija para que una ráfaga de 429 cuente una vez
+        now = time.monotonic()
+        window = max(self.window_latency or self.baseline_latency or 0, self.min_backoff_seconds)
+        if now - self._last_decrease < window:
+            return
+
+        old_limit = self.limit
+        self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+        self._last_decrease = now
+        # Las latencias de la ventana en curso corresponden al límite anterior
+        self._start_epoch()
+        self._hold = 1
+        if int(self.limit) < int(old_limit):
+            self.counters["decreases"] += 1
+            self._record("decrease", old_limit, reason)
+
+    def _record(self, action: str, old_limit: float, reason: str):
+        self.decisions.append({
+            "timestamp": time.time(),
+            "action": action,
+            "old_limit": int(old_limit),
+            "new_limit": self.current_limit,
+            "reason": reason,
+        })
+
+    def run(self, call: Callable, *args, cost: Optional[Callable[[Any], float]] = None, **kwargs):
+        """
+        Ejecuta una llamada dentro del límite, midiendo su latencia y clasificando el resultado.
+        cost(resultado) normaliza la latencia (p. ej. por número de páginas) para que documentos
+        de distinto tamaño sean comparables.
+        """
+        epoch = self.acquire()
+        start_time = time.monotonic()
+        outcome = "error"
+        latency_cost = 1.0
+        try:
+            result = call(*args, **kwargs)
+            outcome = "success" if result else "no_response"
+            if result and cost:
+                latency_cost = max(cost(result), 1.0)
+            return result
+        except Exception as e:
+            outcome = classify_exception(e)
+            raise
+        finally:
+            self.release((time.monotonic() - start_time) / latency_cost, outcome, epoch)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Métricas actuales del limitador"""
+        with self._condition:
+            baseline = self.baseline_latency
+            return {
+                "limit": self.current_limit,
+                "inflight": self.inflight,
+                "window_latency": round(self.window_latency, 4) if self.window_latency else None,
+                "baseline_latency": round(baseline, 4) if baseline else None,
+                **self.counters,
+                "last_decisions": list(self.decisions)[-10:],
+            }
+
+
+def _page_count(response: Any) -> float:
+    return len(get_pages(response))
+
+
+class AdaptiveOCRProcessor:
+    """
+    Envuelve un procesador OCR para que todas sus llamadas al API pasen por el limitador.
+    La latencia se mide por página devuelta. Con el procesador del proyecto, que devuelve None
+    ante cualquier error, una respuesta vacía reduce el límite (ver none_is_congestion).
+    """
+
+    def __init__(self, processor=None, limiter: Optional[AdaptiveConcurrencyLimiter] = None):
+        if processor is None:
+            from src.ocr_processor import MistralOCRProcessor
+            processor = MistralOCRProcessor()
+        self.processor = processor
+        self.limiter = limiter or AdaptiveConcurrencyLimiter()
+
+    def process_local_file(self, file_path: str):
+        return self.limiter.run(self.processor.process_local_file, file_path, cost=_page_count)
+
+    def upload_and_process_file(self, file_path: str):
+        return self.limiter.run(self.processor.upload_and_process_file, file_path, cost=_page_count)
+
+    def process_document_from_url(self, url: str, document_type: str = "document_url"):
+        return self.limiter.run(self.processor.process_document_from_url, url, document_type, cost=_page_count)
+
+    def __getattr__(self, name: str):
+        # extract_text_content, save_results, etc. no llaman al API
+        return getattr(self.processor, name)
+
+
+class ThrottledError(Exception):
+    """Error 429 del servicio simulado"""
+
+    status_code = 429
+
+
+class ThrottlingService:
+    """
+    Servicio local que imita a un API con capacidad limitada:
+    hasta 'capacity' peticiones simultáneas responden en base_latency (± jitter); por encima
+    se encolan en orden de llegada (sube la latencia) y a partir de capacity * throttle_factor
+    responde 429. La cola se calcula con los instantes en que queda libre cada hueco, en lugar
+    de un semáforo, porque threading.Semaphore no es FIFO y dejaría peticiones sin atender.
+    """
+
+    def __init__(self, capacity: int = 8, base_latency: float = 0.05, throttle_factor: float = 2.0,
+                 jitter: float = 0.0):
+        self.capacity = capacity
+        self.base_latency = base_latency
+        self.jitter = jitter
+        self.throttle_at = int(capacity * throttle_factor)
+        self._slot_free_at = [0.0] * capacity
+        self._lock = threading.Lock()
+        self._active = 0
+        self.completed = 0
+        self.throttled = 0
+        self.total_latency = 0.0
+
+    def request(self, _payload=None) -> bool:
+        start_time = time.monotonic()
+        with self._lock:
+            if self._active >= self.throttle_at:
+                self.throttled += 1
+                raise ThrottledError("429 Too Many Requests")
+            self._active += 1
+            service_time = self.base_latency * random.uniform(1 - self.jitter, 1 + self.jitter)
+            finish_at = max(start_time, heapq.heappop(self._slot_free_at)) + service_time
+            heapq.heappush(self._slot_free_at, finish_at)
+
+        try:
+            time.sleep(max(finish_at - time.monotonic(), 0))
+            with self._lock:
+                self.completed += 1
+                self.total_latency += time.monotonic() - start_time
+            return True
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    @property
+    def optimal_throughput(self) -> float:
+        """Peticiones por segundo con la capacidad justa ocupada"""
+        return self.capacity / self.base_latency
+
+
+def simulate(duration: float = 10.0, capacity: int = 8, base_latency: float = 0.05, clients: int = 64,
+             initial_limit: int = 1, jitter: float = 0.0) -> Dict[str, Any]:
+    """Lanza 'clients' hilos contra el servicio simulado a través del limitador y mide la convergencia"""
+    service = ThrottlingService(capacity, base_latency, jitter=jitter)
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=initial_limit, max_limit=clients)
+    stop_at = time.monotonic() + duration
+    trace: List[Dict[str, float]] = []
+
+    def client():
+        while time.monotonic() < stop_at:
+            try:
+                limiter.run(service.request)
+            except ThrottledError:
+                time.sleep(base_latency / 10)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    start_time = time.monotonic()
+    for thread in threads:
+        thread.start()
+
+    last_completed = 0
+    last_latency = 0.0
+    interval = duration / 20
+    while time.monotonic() < stop_at:
+        time.sleep(interval)
+        completed, total_latency = service.completed, service.total_latency
+        done = completed - last_completed
+        trace.append({
+            "t": round(time.monotonic() - start_time, 2),
+            "limit": limiter.current_limit,
+            "throughput": done / interval,
+            "latency": (total_latency - last_latency) / done if done else 0.0,
+        })
+        last_completed, last_latency = completed, total_latency
+
+    for thread in threads:
+        thread.join()
+
+    # Convergencia: segunda mitad de la simulación
+    steady = trace[len(trace) // 2:]
+    steady_throughput = sum(point["throughput"] for point in steady) / len(steady)
+    steady_limit = sum(point["limit"] for point in steady) / len(steady)
+    steady_latency = sum(point["latency"] for point in steady) / len(steady)
+
+    return {
+        "optimal_throughput": service.optimal_throughput,
+        "steady_throughput": round(steady_throughput, 1),
+        "throughput_ratio": round(steady_throughput / service.optimal_throughput, 3),
+        "steady_limit": round(steady_limit, 1),
+        "limit_ratio": round(steady_limit / capacity, 3),
+        "steady_latency": round(steady_latency, 4),
+        "latency_ratio": round(steady_latency / base_latency, 3),
+        "capacity": capacity,
+        "base_latency": base_latency,
+        "throttled_requests": service.throttled,
+        "limiter": limiter.snapshot(),
+        "trace": trace,
+    }
+
+
+def check_convergence(results: Dict[str, Any]) -> List[str]:
+    """
+    Criterios de convergencia: throughput cercano al óptimo, límite cercano a la capacidad
+    y latencia cercana a la de sin carga (no basta con llenar una cola sin pérdidas).
+    Los umbrales son fijos y no dependen de la tolerancia de latencia del limitador.
+    """
+    failures = []
+    if results["throughput_ratio"] < 0.8:
+        failures.append(f"throughput al {results['throughput_ratio']:.0%} del óptimo (mínimo 80%)")
+    if not 0.7 <= results["limit_ratio"] <= 1.5:
+        failures.append(f"límite medio {results['steady_limit']} para capacidad {results['capacity']} "
+                        f"(esperado entre 0.7x y 1.5x)")
+    if results["latency_ratio"] > 1.4:
+        failures.append(f"latencia media {results['steady_latency']}s, {results['latency_ratio']}x "
+                        f"la latencia sin carga (máximo 1.4x)")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Control adaptativo de concurrencia (AIMD)')
+    parser.add_argument('--simulate', action='store_true', help='Simular contra un servicio local con limitación')
+    parser.add_argument('--duration', type=float, default=10.0, help='Duración de la simulación (segundos)')
+    parser.add_argument('--capacity', type=int, default=8, help='Capacidad del servicio simulado')
+    parser.add_argument('--latency', type=float, default=0.05, help='Latencia base del servicio simulado')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Variación relativa de la latencia entre peticiones (p. ej. 0.5 = ±50%%)')
+    parser.add_argument('--clients', type=int, default=64, help='Hilos cliente (y límite máximo)')
+    args = parser.parse_args()
+
+    if not args.simulate:
+        parser.print_help()
+        sys.exit(0)
+
+    results = simulate(args.duration, args.capacity, args.latency, clients=args.clients, jitter=args.jitter)
+
+    print("⏱️ Evolución del límite:")
+    for point in results["trace"]:
+        print(f"  t={point['t']:>5}s  límite={point['limit']:>3}  {point['throughput']:>7.1f} req/s  "
+              f"latencia={point['latency']:.3f}s")
+
+    print(f"\n📊 Resultado:")
+    print(f"  • Capacidad del servicio: {results['capacity']} peticiones simultáneas")
+    print(f"  • Límite medio estable: {results['steady_limit']} ({results['limit_ratio']}x la capacidad)")
+    print(f"  • Throughput estable: {results['steady_throughput']} req/s "
+          f"({results['throughput_ratio']:.0%} del óptimo {results['optimal_throughput']:.0f} req/s)")
+    print(f"  • Latencia media estable: {results['steady_latency']}s ({results['latency_ratio']}x la latencia base)")
+    print(f"  • Respuestas 429: {results['throttled_requests']}")
+    print(f"  • Aumentos / reducciones: {results['limiter']['increases']} / {results['limiter']['decreases']}")
+
+    failures = check_convergence(results)
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ Convergencia correcta")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,346 @@
+"""
+Exportación columnar (Parquet) de resultados OCR
+Escribe texto y estadísticas por página, y cada tabla markdown con columnas tipadas,
+en un dataset Parquet particionado por fecha para consultas analíticas vectorizadas
+
+Estructura generada:
+    results/parquet/pages/date=YYYY-MM-DD/<doc_id>.parquet
+    results/parquet/table_index/date=YYYY-MM-DD/<doc_id>.parquet
+    results/parquet/tables/date=YYYY-MM-DD/<doc_id>_p<página>_t<tabla>.parquet
+"""
+
+import hashlib
+import json
+import re
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Añadir src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from src.ocr_processor import MistralOCRProcessor
+from ocr_response import get_field, get_pages, page_markdown
+
+CELL_SPLIT_RE = re.compile(r"(?<!\\)\|")
+SEPARATOR_CELL_RE = re.compile(r"^:?-+:?$")
+THOUSANDS_RE = re.compile(r"^-?[1-9]\d{0,2}(,\d{3})+(\.\d+)?$")
+LEADING_ZERO_RE = re.compile(r"^[-+]?0\d")   # códigos con ceros a la izquierda (facturas, códigos postales)
+
+
+def pages_schema():
+    """Esquema Arrow del dataset de páginas"""
+    import pyarrow as pa
+
+    return pa.schema([
+        ("doc_id", pa.string()),
+        ("source", pa.string()),
+        ("result_file", pa.string()),
+        ("processed_at", pa.timestamp("us")),
+        ("page_index", pa.int64()),
+        ("markdown", pa.string()),
+        ("character_count", pa.int64()),
+        ("word_count", pa.int64()),
+        ("line_count", pa.int64()),
+        ("image_count", pa.int64()),
+        ("table_count", pa.int64()),
+    ])
+
+
+def table_index_schema():
+    """Esquema Arrow del índice de tablas"""
+    import pyarrow as pa
+
+    return pa.schema([
+        ("doc_id", pa.string()),
+        ("page_index", pa.int64()),
+        ("table_index", pa.int64()),
+        ("row_count", pa.int64()),
+        ("column_count", pa.int64()),
+        ("columns", pa.string()),
+        ("dtypes", pa.string()),
+        ("table_file", pa.string()),
+    ])
+
+
+def _split_row(line: str) -> List[str]:
+    """Divide una fila de tabla markdown en celdas (respeta los '\\|' escapados)"""
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    return [cell.strip().replace("\\|", "|") for cell in CELL_SPLIT_RE.split(line)]
+
+
+def _is_separator(line: str) -> bool:
+    """Indica si la línea es el separador de cabecera de una tabla markdown (|---|:--:|)"""
+    cells = _split_row(line)
+    return bool(cells) and all(SEPARATOR_CELL_RE.match(cell.replace(" ", "")) for cell in cells)
+
+
+def _unique_columns(header: List[str]) -> List[str]:
+    """Nombres de columna no vacíos y sin repetir"""
+    columns = []
+    seen: Dict[str, int] = {}
+    for i, name in enumerate(header):
+        name = name or f"col_{i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def parse_markdown_tables(markdown: str) -> List[Dict[str, Any]]:
+    """
+    Extrae las tablas markdown de un texto.
+    Devuelve una lista de dicts con 'columns' y 'rows' (celdas como texto).
+    """
+    tables = []
+    lines = markdown.splitlines()
+    i = 0
+
+    while i < len(lines) - 1:
+        line = lines[i].strip()
+        if line.startswith("|") and _is_separator(lines[i + 1]):
+            columns = _unique_columns(_split_row(line))
+            rows = []
+            i += 2
+            while i < len(lines) and lines[i].strip().startswith("|"):
+                cells = _split_row(lines[i])
+                cells = (cells + [""] * len(columns))[:len(columns)]
+                rows.append(cells)
+                i += 1
+            tables.append({"columns": columns, "rows": rows})
+        else:
+            i += 1
+
+    return tables
+
+
+def _typed_column(values: List[str]):
+    """
+    Convierte una columna de texto a numérica si todos sus valores no vacíos lo son.
+    Si algún valor tiene ceros a la izquierda ("00123") la columna se deja como texto,
+    porque convertirla perdería los ceros.
+    """
+    import pandas as pd
+
+    series = pd.Series([value.strip() for value in values], dtype="object")
+    filled = series != ""
+    if series[filled].map(lambda value: bool(LEADING_ZERO_RE.match(value))).any():
+        return series.astype("string")
+    cleaned = series.map(lambda value: value.replace(",", "") if THOUSANDS_RE.match(value) else value)
+    numeric = pd.to_numeric(cleaned.where(filled), errors="coerce")
+
+    if not filled.any() or numeric[filled].isna().any():
+        return series.astype("string")
+    if (numeric[filled] % 1 == 0).all():
+        if numeric[filled].abs().max() < 2 ** 63:
+            return numeric.astype("Int64")
+        # Fuera del rango de int64 (p. ej. 9223372036854775808): los enteros se conservan
+        # como texto para no perder dígitos; los valores en notación flotante (1e20) como float64
+        if numeric.dtype.kind in "iu":
+            return series.astype("string")
+    return numeric.astype("float64")
+
+
+def table_to_dataframe(table: Dict[str, Any]):
+    """Convierte una tabla parseada en un DataFrame con columnas tipadas"""
+    import pandas as pd
+
+    data = {}
+    for col_idx, name in enumerate(table["columns"]):
+        data[name] = _typed_column([row[col_idx] for row in table["rows"]])
+    return pd.DataFrame(data)
+
+
+class ColumnarExporter:
+    """Escribe resultados OCR en un dataset Parquet particionado por fecha"""
+
+    def __init__(self, base_dir: str = "results/parquet"):
+        self.base_dir = Path(base_dir)
+
+    def _partition(self, dataset: str, processed_at: datetime) -> Path:
+        """Carpeta de la partición (estilo Hive) para un dataset y fecha"""
+        folder = self.base_dir / dataset / f"date={processed_at:%Y-%m-%d}"
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder
+
+    def _remove_previous(self, doc_id: str, keep: set):
+        """Elimina los archivos de un documento en todas las particiones (exportaciones anteriores)"""
+        patterns = [("pages", f"{doc_id}.parquet"), ("table_index", f"{doc_id}.parquet"),
+                    ("tables", f"{doc_id}_p*_t*.parquet")]
+        for dataset, pattern in patterns:
+            for old_file in (self.base_dir / dataset).glob(f"date=*/{pattern}"):
+                if old_file not in keep:
+                    old_file.unlink(missing_ok=True)
+
+    @staticmethod
+    def _stage(table, path: Path, staged: List):
+        """Escribe una tabla Arrow en un archivo temporal junto a su destino final"""
+        import pyarrow.parquet as pq
+
+        tmp_path = path.with_suffix(".parquet.tmp")
+        staged.append((tmp_path, path))
+        pq.write_table(table, tmp_path)
+
+    def export_response(self, response: Any, source: str, result_file: Optional[str] = None,
+                        processed_at: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Exporta una respuesta OCR: una fila por página y un archivo por tabla.
+        Volver a exportar un documento sustituye su exportación anterior, aunque estuviera
+        en otra partición de fecha, así que cada documento aparece una sola vez en el dataset.
+        Todos los archivos se escriben antes de retirar los anteriores: si algo falla,
+        la exportación previa queda intacta.
+        """
+        try:
+            import pandas  # noqa: F401
+            import pyarrow as pa
+        except ImportError:
+            print("❌ Exportación Parquet no disponible. Instala con: pip install pandas pyarrow")
+            return {"error": "pandas/pyarrow no instalados"}
+
+        processed_at = processed_at or datetime.now()
+        doc_id = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+
+        page_rows = []
+        index_rows = []
+        table_files = []
+        staged: List = []
+
+        try:
+            for position, page in enumerate(get_pages(response)):
+                page_index = get_field(page, "index", position)
+                markdown = page_markdown(page)
+                tables = parse_markdown_tables(markdown)
+
+                page_rows.append({
+                    "doc_id": doc_id,
+                    "source": source,
+                    "result_file": result_file,
+                    "processed_at": processed_at,
+                    "page_index": page_index,
+                    "markdown": markdown,
+                    "character_count": len(markdown),
+                    "word_count": len(markdown.split()),
+                    "line_count": len(markdown.splitlines()),
+                    "image_count": len(get_field(page, "images", None) or []),
+                    "table_count": len(tables),
+                })
+
+                for table_index, table in enumerate(tables):
+                    # Las columnas de metadatos llevan prefijo "_" para no chocar con las de la tabla
+                    df = table_to_dataframe(table)
+                    df.insert(0, "_row_index", range(len(df)))
+                    df.insert(0, "_table_index", table_index)
+                    df.insert(0, "_page_index", page_index)
+                    df.insert(0, "_doc_id", doc_id)
+
+                    table_path = self._partition("tables", processed_at) / \
+                        f"{doc_id}_p{page_index:04d}_t{table_index:02d}.parquet"
+                    self._stage(pa.Table.from_pandas(df, preserve_index=False), table_path, staged)
+                    table_files.append(str(table_path))
+
+                    index_rows.append({
+                        "doc_id": doc_id,
+                        "page_index": page_index,
+                        "table_index": table_index,
+                        "row_count": len(table["rows"]),
+                        "column_count": len(table["columns"]),
+                        "columns": json.dumps(table["columns"], ensure_ascii=False),
+                        "dtypes": json.dumps({name: str(dtype) for name, dtype in df.dtypes.items()}),
+                        "table_file": str(table_path),
+                    })
+
+            # Esquemas fijos: un valor nulo en un documento no debe cambiar el tipo de la columna
+            pages_path = self._partition("pages", processed_at) / f"{doc_id}.parquet"
+            self._stage(pa.Table.from_pylist(page_rows, schema=pages_schema()), pages_path, staged)
+
+            if index_rows:
+                index_path = self._partition("table_index", processed_at) / f"{doc_id}.parquet"
+                self._stage(pa.Table.from_pylist(index_rows, schema=table_index_schema()), index_path, staged)
+
+        except Exception:
+            for tmp_path, _ in staged:
+                tmp_path.unlink(missing_ok=True)
+            raise
+
+        self._remove_previous(doc_id, keep={path for _, path in staged})
+        for tmp_path, path in staged:
+            tmp_path.replace(path)
+
+        return {
+            "doc_id": doc_id,
+            "pages_file": str(pages_path),
+            "page_count": len(page_rows),
+            "table_files": table_files,
+        }
+
+
+def export_results_folder(results_folder: str = "results", base_dir: str = "results/parquet") -> Dict[str, Any]:
+    """
+    Exporta a Parquet todos los JSON ya guardados en la carpeta de resultados.
+    La fecha de cada documento es la de modificación de su JSON (cuando se procesó),
+    así que repetir la exportación otro día da el mismo resultado.
+    """
+    exporter = ColumnarExporter(base_dir)
+    summary = {"exported_files": 0, "failed_files": 0, "pages": 0, "tables": 0}
+
+    for json_file in sorted(Path(results_folder).glob("*.json")):
+        try:
+            with open(json_file, "r", encoding="utf-8") as f:
+                response = json.load(f)
+            if not get_pages(response):
+                continue
+
+            processed_at = datetime.fromtimestamp(json_file.stat().st_mtime)
+            result = exporter.export_response(response, source=json_file.name, result_file=str(json_file),
+                                              processed_at=processed_at)
+            if "error" in result:
+                return {"error": result["error"]}
+
+            summary["exported_files"] += 1
+            summary["pages"] += result["page_count"]
+            summary["tables"] += len(result["table_files"])
+
+        except Exception as e:
+            print(f"❌ Error exportando {json_file.name}: {e}")
+            summary["failed_files"] += 1
+
+    return summary
+
+
+class ColumnarOCRProcessor(MistralOCRProcessor):
+    """Procesador OCR que exporta cada resultado a Parquet al guardarlo"""
+
+    def __init__(self, *args, parquet_dir: str = "results/parquet", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.columnar_exporter = ColumnarExporter(parquet_dir)
+
+    def save_results(self, response, filename: str):
+        result_file = super().save_results(response, filename)
+
+        try:
+            self.columnar_exporter.export_response(response, source=filename,
+                                                   result_file=str(result_file) if result_file else None)
+        except Exception as e:
+            print(f"⚠️ No se pudo exportar a Parquet: {e}")
+
+        return result_file
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Exporta los resultados OCR guardados a Parquet")
+    parser.add_argument("--results", "-r", default="results", help="Carpeta con los JSON de resultados")
+    parser.add_argument("--output", "-o", default="results/parquet", help="Carpeta del dataset Parquet")
+    args = parser.parse_args()
+
+    summary = export_results_folder(args.results, args.output)
+    print(f"📦 Exportación Parquet: {summary}")
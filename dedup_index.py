@@ -0,0 +1,445 @@
+"""
+Detección de documentos casi duplicados antes del OCR
+Compara cada documento con los ya procesados usando:
+    - sha256 del archivo (duplicado exacto)
+    - MinHash sobre la capa de texto embebida (PDF) o el texto del DOCX
+    - dHash perceptual de las imágenes y de la imagen principal de cada página PDF
+El índice vive en SQLite con LSH por bandas (MinHash) y multi-índice por trozos (dHash),
+así que cada búsqueda solo compara contra unos pocos candidatos.
+Solo se consideran casi duplicados documentos con el mismo número de páginas, y una huella
+parcial (PDF de más de MAX_FINGERPRINT_PAGES páginas) nunca basta para reutilizar un resultado.
+Dos contratos que solo difieren en un importe tienen una similitud de texto cercana a 1, por eso
+por defecto los casi duplicados solo se marcan y reutilizarlos es opcional (action='reuse').
+"""
+
+import hashlib
+import io
+import json
+import re
+import sqlite3
+from datetime import datetime
+from itertools import combinations
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from ocr_response import result_filename_for
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.avif')
+
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16          # 16 bandas x 4 filas: candidatos a partir de ~50% de similitud
+SHINGLE_SIZE = 5        # palabras por shingle
+MIN_TEXT_CHARS = 200    # por debajo, la capa de texto no se considera fiable
+MAX_FINGERPRINT_PAGES = 100   # páginas que entran en la huella; por encima la huella es parcial
+MERSENNE_PRIME = (1 << 31) - 1
+MINHASH_BLOCK = 8192    # shingles permutados a la vez (acota la memoria en documentos largos)
+PHASH_CHUNKS = 4        # trozos de 16 bits del dHash en el multi-índice
+PHASH_CHUNK_BITS = 64 // PHASH_CHUNKS
+
+
+def _minhash_params():
+    """Coeficientes fijos de las permutaciones (deterministas entre ejecuciones)"""
+    import numpy as np
+
+    rng = np.random.default_rng(20240601)
+    a = rng.integers(1, MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+    b = rng.integers(0, MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signature(text: str) -> Optional[List[int]]:
+    """Firma MinHash de los shingles de palabras de un texto (None si hay poco texto)"""
+    import numpy as np
+
+    words = re.findall(r"\w+", text.lower())
+    if len(" ".join(words)) < MIN_TEXT_CHARS:
+        return None
+
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") % MERSENNE_PRIME
+         for s in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+
+    a, b = _minhash_params()
+    signature = np.full(MINHASH_PERMUTATIONS, MERSENNE_PRIME, dtype=np.uint64)
+    for start in range(0, len(hashes), MINHASH_BLOCK):
+        block = hashes[start:start + MINHASH_BLOCK]
+        # (a * x + b) mod p cabe en uint64 porque a, x < 2^31
+        permuted = (block[:, None] * a[None, :] + b[None, :]) % MERSENNE_PRIME
+        signature = np.minimum(signature, permuted.min(axis=0))
+    return signature.astype(int).tolist()
+
+
+def dhash(image, hash_size: int = 8) -> int:
+    """Hash perceptual por diferencias (64 bits) de una imagen PIL"""
+    from PIL import Image
+
+    gray = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def _dhash_bytes(data: bytes) -> Optional[int]:
+    """dHash de una imagen en bytes (None si Pillow no puede abrirla)"""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return dhash(image)
+    except Exception:
+        return None
+
+
+def fingerprint_file(file_path: str) -> Dict[str, Any]:
+    """
+    Calcula la huella de un archivo: sha256, número de páginas, firma MinHash del texto y dHash por página.
+    En los PDF, PyPDF2 no renderiza páginas, así que se usa la imagen embebida más grande
+    de cada página (en un PDF escaneado es la propia página). 'truncated' indica que solo
+    se han tenido en cuenta las primeras MAX_FINGERPRINT_PAGES páginas.
+    """
+    path = Path(file_path)
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+
+    text = ""
+    page_hashes: List[int] = []
+    page_count = None
+    truncated = False
+    extension = path.suffix.lower()
+
+    if extension in IMAGE_EXTENSIONS:
+        page_count = 1
+        page_hash = _dhash_bytes(path.read_bytes())
+        if page_hash is not None:
+            page_hashes.append(page_hash)
+
+    elif extension == ".pdf":
+        from PyPDF2 import PdfReader
+
+        reader = PdfReader(str(path))
+        page_count = len(reader.pages)
+        truncated = page_count > MAX_FINGERPRINT_PAGES
+        texts = []
+        for page in reader.pages[:MAX_FINGERPRINT_PAGES]:
+            texts.append(page.extract_text() or "")
+            try:
+                images = page.images
+            except Exception:
+                images = []
+            if images:
+                largest = max(images, key=lambda image: len(image.data))
+                page_hash = _dhash_bytes(largest.data)
+                if page_hash is not None:
+                    page_hashes.append(page_hash)
+        text = "\n".join(texts)
+
+    elif extension == ".docx":
+        import docx2txt
+
+        text = docx2txt.process(str(path)) or ""
+
+    return {
+        "sha256": sha256.hexdigest(),
+        "page_count": page_count,
+        "truncated": truncated,
+        "minhash": minhash_signature(text) if text else None,
+        "page_hashes": page_hashes,
+    }
+
+
+def text_similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    """Similitud de Jaccard estimada a partir de dos firmas MinHash"""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+def image_similarity(hashes_a: List[int], hashes_b: List[int], max_distance: int) -> float:
+    """Fracción de páginas de cada documento con una página equivalente en el otro"""
+    if not hashes_a or not hashes_b:
+        return 0.0
+
+    def covered(source: List[int], target: List[int]) -> float:
+        return sum(1 for h in source if any(bin(h ^ t).count("1") <= max_distance for t in target)) / len(source)
+
+    return min(covered(hashes_a, hashes_b), covered(hashes_b, hashes_a))
+
+
+class DedupIndex:
+    """Índice persistente de huellas de documentos ya procesados"""
+
+    def __init__(self, db_path: str = "results/dedup_index.db", max_distance: int = 5):
+        self.db_path = db_path
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.init_database(max_distance)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def init_database(self, max_distance: int):
+        """Crea las tablas; la distancia máxima entre dHash queda fijada al crear el índice"""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_path TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                result_file TEXT,
+                page_count INTEGER,
+                minhash TEXT,
+                page_hashes TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_sha256 ON documents (sha256);
+            CREATE TABLE IF NOT EXISTS lsh_buckets (band INTEGER, bucket TEXT, doc_id INTEGER);
+            CREATE INDEX IF NOT EXISTS idx_lsh ON lsh_buckets (band, bucket);
+            CREATE TABLE IF NOT EXISTS phash_chunks (chunk INTEGER, value INTEGER, doc_id INTEGER);
+            CREATE INDEX IF NOT EXISTS idx_phash ON phash_chunks (chunk, value);
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('max_distance', ?)", (str(max_distance),))
+        conn.commit()
+
+        cursor.execute("SELECT value FROM meta WHERE key = 'max_distance'")
+        self.max_distance = int(cursor.fetchone()[0])
+        conn.close()
+
+        # Si dos hashes están a distancia <= max_distance, al menos uno de los PHASH_CHUNKS trozos
+        # difiere en <= max_distance // PHASH_CHUNKS bits (principio del palomar), así que basta con
+        # buscar en cada trozo los valores a esa distancia. Con trozos de 16 bits los documentos se
+        # reparten en 65536 cubetas por trozo
+        self.probe_radius = self.max_distance // PHASH_CHUNKS
+
+    def _bands(self, signature: List[int]) -> List[str]:
+        rows = MINHASH_PERMUTATIONS // LSH_BANDS
+        return [hashlib.md5(json.dumps(signature[i * rows:(i + 1) * rows]).encode()).hexdigest()[:16]
+                for i in range(LSH_BANDS)]
+
+    @staticmethod
+    def _chunks(page_hash: int) -> List[int]:
+        mask = (1 << PHASH_CHUNK_BITS) - 1
+        return [(page_hash >> (i * PHASH_CHUNK_BITS)) & mask for i in range(PHASH_CHUNKS)]
+
+    def _probes(self, value: int) -> List[int]:
+        """Valores de un trozo a distancia de Hamming <= probe_radius"""
+        probes = [value]
+        for radius in range(1, self.probe_radius + 1):
+            for bits in combinations(range(PHASH_CHUNK_BITS), radius):
+                flipped = value
+                for bit in bits:
+                    flipped ^= 1 << bit
+                probes.append(flipped)
+        return probes
+
+    def add(self, file_path: str, fingerprint: Dict[str, Any], result_file: Optional[str] = None) -> int:
+        """Añade un documento procesado al índice"""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT INTO documents (file_path, sha256, result_file, page_count, minhash, page_hashes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            file_path, fingerprint["sha256"], result_file, fingerprint.get("page_count"),
+            json.dumps(fingerprint["minhash"]) if fingerprint["minhash"] else None,
+            json.dumps(fingerprint["page_hashes"]),
+        ))
+        doc_id = cursor.lastrowid
+
+        if fingerprint["minhash"]:
+            cursor.executemany("INSERT INTO lsh_buckets (band, bucket, doc_id) VALUES (?, ?, ?)",
+                               [(band, bucket, doc_id) for band, bucket in enumerate(self._bands(fingerprint["minhash"]))])
+
+        chunk_rows = {(chunk, value, doc_id)
+                      for page_hash in fingerprint["page_hashes"]
+                      for chunk, value in enumerate(self._chunks(page_hash))}
+        cursor.executemany("INSERT INTO phash_chunks (chunk, value, doc_id) VALUES (?, ?, ?)", chunk_rows)
+
+        conn.commit()
+        conn.close()
+        return doc_id
+
+    def _candidates(self, cursor, fingerprint: Dict[str, Any]) -> set:
+        """Documentos que comparten una banda LSH o un trozo de dHash y tienen el mismo número de páginas"""
+        candidates = set()
+        page_count = fingerprint.get("page_count")
+
+        if fingerprint["minhash"]:
+            for band, bucket in enumerate(self._bands(fingerprint["minhash"])):
+                cursor.execute("SELECT DISTINCT l.doc_id FROM lsh_buckets l JOIN documents d ON d.id = l.doc_id "
+                               "WHERE l.band = ? AND l.bucket = ? AND d.page_count IS ?",
+                               (band, bucket, page_count))
+                candidates.update(row[0] for row in cursor.fetchall())
+
+        for page_hash in fingerprint["page_hashes"]:
+            for chunk, value in enumerate(self._chunks(page_hash)):
+                probes = self._probes(value)
+                placeholders = ", ".join("?" * len(probes))
+                cursor.execute("SELECT DISTINCT p.doc_id FROM phash_chunks p JOIN documents d ON d.id = p.doc_id "
+                               f"WHERE p.chunk = ? AND p.value IN ({placeholders}) AND d.page_count IS ?",
+                               (chunk, *probes, page_count))
+                candidates.update(row[0] for row in cursor.fetchall())
+
+        return candidates
+
+    def find_duplicate(self, fingerprint: Dict[str, Any], threshold: float = 0.9) -> Optional[Dict[str, Any]]:
+        """
+        Busca el documento indexado más parecido con similitud >= threshold.
+        Solo se comparan documentos con el mismo número de páginas. Si ambos tienen capa de texto
+        se compara el texto; si no, las imágenes de las páginas. 'partial' indica que la huella
+        no cubre todo el documento.
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT id, file_path, result_file FROM documents WHERE sha256 = ? ORDER BY id LIMIT 1",
+                       (fingerprint["sha256"],))
+        row = cursor.fetchone()
+        if row:
+            conn.close()
+            return {"doc_id": row[0], "file_path": row[1], "result_file": row[2],
+                    "similarity": 1.0, "match_type": "exact", "partial": False}
+
+        best = None
+        candidates = self._candidates(cursor, fingerprint)
+        for doc_id in candidates:
+            cursor.execute("SELECT file_path, result_file, minhash, page_hashes FROM documents "
+                           "WHERE id = ?", (doc_id,))
+            file_path, result_file, minhash, page_hashes = cursor.fetchone()
+
+            if fingerprint["minhash"] and minhash:
+                similarity = text_similarity(fingerprint["minhash"], json.loads(minhash))
+                match_type = "text"
+            else:
+                similarity = image_similarity(fingerprint["page_hashes"], json.loads(page_hashes), self.max_distance)
+                match_type = "image"
+
+            if similarity >= threshold and (best is None or similarity > best["similarity"]):
+                best = {"doc_id": doc_id, "file_path": file_path, "result_file": result_file,
+                        "similarity": round(similarity, 4), "match_type": match_type,
+                        "partial": bool(fingerprint.get("truncated"))}
+
+        conn.close()
+        return best
+
+
+class DedupStage:
+    """
+    Etapa previa al OCR: detecta duplicados y decide si reutilizar el resultado o solo marcarlo.
+    'flag' procesa siempre y solo marca la coincidencia, 'exact' reutiliza únicamente los
+    duplicados byte a byte y 'reuse' también los casi duplicados.
+    """
+
+    ACTIONS = ("flag", "exact", "reuse")
+
+    def __init__(self, index: DedupIndex, threshold: float = 0.9, action: str = "flag"):
+        if action not in self.ACTIONS:
+            raise ValueError(f"Acción no válida: {action} (usa {', '.join(self.ACTIONS)})")
+        self.index = index
+        self.threshold = threshold
+        self.action = action
+
+    def check(self, file_path: str):
+        """
+        Devuelve (huella, coincidencia o None) para un archivo local.
+        La deduplicación es solo una optimización: si no se puede calcular la huella
+        se devuelve (None, None) y el archivo pasa al OCR sin registrarse.
+        """
+        try:
+            fingerprint = fingerprint_file(file_path)
+            return fingerprint, self.index.find_duplicate(fingerprint, self.threshold)
+        except Exception as e:
+            print(f"⚠️ No se pudo calcular la huella de {Path(file_path).name} ({e}); se procesa sin deduplicar")
+            return None, None
+
+    def can_reuse(self, match: Optional[Dict[str, Any]]) -> bool:
+        """Indica si se puede devolver el resultado guardado de una coincidencia en lugar de hacer OCR"""
+        if not match or self.action == "flag":
+            return False
+        if self.action == "exact" and match["match_type"] != "exact":
+            return False
+        return bool(not match.get("partial") and match["result_file"] and Path(match["result_file"]).exists())
+
+    def register(self, file_path: str, fingerprint: Dict[str, Any], result_file: Optional[str]):
+        """Registra un documento recién procesado"""
+        self.index.add(file_path, fingerprint, result_file)
+
+
+def process_with_dedup(processor, file_path: str, stage: DedupStage, result_filename: str,
+                       method: str = "local") -> Dict[str, Any]:
+    """
+    Procesa un archivo local pasando antes por la etapa de deduplicación.
+    Si la etapa permite reutilizarlo, un duplicado devuelve el resultado guardado sin llamar al API.
+    """
+    fingerprint, match = stage.check(file_path)
+
+    if stage.can_reuse(match):
+        print(f"♻️ Duplicado de {match['file_path']} ({match['match_type']}, {match['similarity']:.0%}): "
+              f"se reutiliza {match['result_file']}")
+        with open(match["result_file"], "r", encoding="utf-8") as f:
+            return {"response": json.load(f), "result_file": match["result_file"], "duplicate_of": match,
+                    "reused": True}
+
+    if match:
+        print(f"🚩 Posible duplicado de {match['file_path']} ({match['similarity']:.0%})")
+
+    if method == "upload":
+        response = processor.upload_and_process_file(file_path)
+    else:
+        response = processor.process_local_file(file_path)
+
+    result_file = None
+    if response:
+        result_file = str(processor.save_results(response, result_filename))
+        if fingerprint:
+            stage.register(file_path, fingerprint, result_file)
+
+    return {"response": response, "result_file": result_file, "duplicate_of": match, "reused": False}
+
+
+def dedup_batch_process(folder_path: str, processor, stage: DedupStage) -> Dict[str, Any]:
+    """Procesa en lote una carpeta evitando OCR repetido de documentos casi duplicados"""
+    supported_extensions = ['.pdf', '.docx', '.pptx', '.png', '.jpg', '.jpeg', '.avif']
+    files = [f for f in sorted(Path(folder_path).rglob("*.*")) if f.suffix.lower() in supported_extensions]
+
+    results = {
+        "total_files": len(files),
+        "processed_files": 0,
+        "reused_files": 0,
+        "flagged_files": 0,
+        "failed_files": 0,
+        "timestamp": datetime.now().isoformat(),
+        "files": [],
+    }
+
+    for file_path in files:
+        try:
+            outcome = process_with_dedup(processor, str(file_path), stage, result_filename_for(str(file_path)))
+        except Exception as e:
+            print(f"❌ Error procesando {file_path.name}: {e}")
+            results["failed_files"] += 1
+            continue
+
+        match = outcome["duplicate_of"]
+        if not outcome["response"]:
+            results["failed_files"] += 1
+        elif outcome["reused"]:
+            results["reused_files"] += 1
+        else:
+            results["processed_files"] += 1
+            results["flagged_files"] += bool(match)
+
+        results["files"].append({"filename": file_path.name, "result_file": outcome["result_file"],
+                                 "duplicate_of": match})
+
+    return results
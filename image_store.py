@@ -0,0 +1,172 @@
+"""
+Control de las imágenes incluidas en las respuestas OCR
+Permite descartarlas o decodificarlas a disco por bloques, deduplicadas por hash,
+sustituyendo el base64 de la respuesta por una referencia ligera
+
+Modos:
+    inline  -> se conserva el base64 tal como llega del API
+    skip    -> se elimina el base64 (se mantienen id y coordenadas de cada imagen)
+    store   -> se guarda la imagen en results/images/<hash>.<ext> y se deja la referencia
+"""
+
+import base64
+import hashlib
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Añadir src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from src.ocr_processor import MistralOCRProcessor
+from ocr_response import get_field, get_pages, set_field
+
+IMAGE_MODES = ("inline", "skip", "store")
+IMAGE_REF_PREFIX = "ocr-image-ref:"
+
+# Bloque de decodificación: múltiplo de 4 caracteres base64 (48 KB decodificados)
+DECODE_CHUNK_CHARS = 64 * 1024
+
+MAGIC_EXTENSIONS = [
+    (b"\x89PNG", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF8", "gif"),
+    (b"RIFF", "webp"),
+]
+
+
+def is_image_ref(value: Any) -> bool:
+    """Indica si un valor de image_base64 es una referencia al almacén"""
+    return isinstance(value, str) and value.startswith(IMAGE_REF_PREFIX)
+
+
+def _extension_for(head: bytes) -> str:
+    """Extensión de archivo según la firma de los primeros bytes"""
+    for magic, extension in MAGIC_EXTENSIONS:
+        if head.startswith(magic):
+            return extension
+    return "bin"
+
+
+class ImageStore:
+    """Almacén de imágenes direccionado por contenido (sha256), compartido entre páginas y documentos"""
+
+    def __init__(self, base_dir: str = "results/images"):
+        self.base_dir = Path(base_dir)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.stats = {"stored": 0, "deduplicated": 0, "bytes_written": 0, "bytes_deduplicated": 0}
+        self._lock = threading.Lock()
+
+    def put_base64(self, data: str) -> str:
+        """
+        Decodifica una imagen base64 a disco por bloques, calculando el hash a la vez,
+        y devuelve su referencia. Si la imagen ya existe no se vuelve a escribir.
+        Lanza ValueError (binascii.Error) si el base64 no es válido, sin dejar archivos temporales.
+        """
+        if data.startswith("data:"):
+            data = data[data.index(",") + 1:]
+
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+
+        tmp = tempfile.NamedTemporaryFile(dir=self.base_dir, suffix=".tmp", delete=False)
+        tmp_path = Path(tmp.name)
+        try:
+            with tmp:
+                for start in range(0, len(data), DECODE_CHUNK_CHARS):
+                    chunk = base64.b64decode(data[start:start + DECODE_CHUNK_CHARS])
+                    head = head or chunk[:16]
+                    digest.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        name = f"{digest.hexdigest()}.{_extension_for(head)}"
+        final_path = self.base_dir / name[:2] / name
+
+        with self._lock:
+            if final_path.exists():
+                tmp_path.unlink()
+                self.stats["deduplicated"] += 1
+                self.stats["bytes_deduplicated"] += size
+            else:
+                final_path.parent.mkdir(exist_ok=True)
+                tmp_path.replace(final_path)
+                self.stats["stored"] += 1
+                self.stats["bytes_written"] += size
+
+        return f"{IMAGE_REF_PREFIX}{name}"
+
+    def resolve(self, ref: str) -> Path:
+        """Ruta en disco de una referencia"""
+        name = ref[len(IMAGE_REF_PREFIX):]
+        return self.base_dir / name[:2] / name
+
+    def read(self, ref: str) -> bytes:
+        """Bytes de la imagen de una referencia"""
+        return self.resolve(ref).read_bytes()
+
+
+def apply_image_mode(response: Any, mode: str, store: Optional[ImageStore] = None) -> Dict[str, int]:
+    """
+    Aplica el modo de imágenes a una respuesta OCR (la modifica en el sitio).
+    La lista de imágenes de cada página se conserva, así que el conteo de imágenes no cambia.
+    Una imagen con base64 no válido se descarta (como en el modo 'skip') sin que falle el documento.
+    """
+    if mode not in IMAGE_MODES:
+        raise ValueError(f"Modo de imágenes no válido: {mode} (usa {', '.join(IMAGE_MODES)})")
+    if mode == "store" and store is None:
+        raise ValueError("El modo 'store' necesita un ImageStore")
+
+    summary = {"images": 0, "removed_bytes": 0, "invalid_images": 0}
+    if mode == "inline":
+        return summary
+
+    for page in get_pages(response):
+        for image in get_field(page, "images", None) or []:
+            data = get_field(image, "image_base64", None)
+            if not data or is_image_ref(data):
+                continue
+
+            summary["images"] += 1
+            summary["removed_bytes"] += len(data)
+            ref = None
+            if mode == "store":
+                try:
+                    ref = store.put_base64(data)
+                except ValueError as e:
+                    print(f"⚠️ Imagen {get_field(image, 'id', '?')} con base64 no válido, se descarta: {e}")
+                    summary["invalid_images"] += 1
+            set_field(image, "image_base64", ref)
+
+    return summary
+
+
+class ImageControlledOCRProcessor(MistralOCRProcessor):
+    """Procesador OCR que descarta o externaliza las imágenes de cada respuesta"""
+
+    def __init__(self, *args, image_mode: str = "store", images_dir: str = "results/images", **kwargs):
+        super().__init__(*args, **kwargs)
+        if image_mode not in IMAGE_MODES:
+            raise ValueError(f"Modo de imágenes no válido: {image_mode} (usa {', '.join(IMAGE_MODES)})")
+        self.image_mode = image_mode
+        self.image_store = ImageStore(images_dir) if image_mode == "store" else None
+
+    def _with_image_mode(self, response):
+        if response:
+            apply_image_mode(response, self.image_mode, self.image_store)
+        return response
+
+    def process_local_file(self, file_path: str):
+        return self._with_image_mode(super().process_local_file(file_path))
+
+    def upload_and_process_file(self, file_path: str):
+        return self._with_image_mode(super().upload_and_process_file(file_path))
+
+    def process_document_from_url(self, url: str, document_type: str = "document_url"):
+        return self._with_image_mode(super().process_document_from_url(url, document_type))
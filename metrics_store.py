@@ -0,0 +1,451 @@
+"""
+Almacén de métricas agregadas de procesamiento OCR
+Mantiene contadores por intervalo de tiempo e histogramas de latencia combinables,
+agrupados por método, tipo de archivo y tamaño. La memoria y el tiempo de consulta
+dependen solo de la retención configurada, no del número de documentos procesados.
+"""
+
+import atexit
+import glob
+import json
+import math
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Añadir src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from src.ocr_processor import MistralOCRProcessor
+from ocr_response import get_pages
+
+METRICS_DIR = "results/metrics"   # un almacén por proceso; se combinan con load_combined()
+
+# Límites superiores (segundos) de las cubetas del histograma: escala logarítmica de 50 ms a ~2.5 h
+LATENCY_BOUNDS = [round(0.05 * 2 ** (i / 2), 4) for i in range(32)]
+
+SIZE_CLASSES = [
+    (100 * 1024, "<100KB"),
+    (1024 * 1024, "100KB-1MB"),
+    (5 * 1024 * 1024, "1-5MB"),
+    (20 * 1024 * 1024, "5-20MB"),
+]
+
+RESOLUTIONS = {
+    "hourly": "%Y-%m-%dT%H:00",
+    "daily": "%Y-%m-%d",
+}
+
+
+def size_class(size_bytes: Optional[int]) -> str:
+    """Clase de tamaño de un documento"""
+    if size_bytes is None:
+        return "unknown"
+    for limit, label in SIZE_CLASSES:
+        if size_bytes < limit:
+            return label
+    return ">20MB"
+
+
+def default_store_path() -> str:
+    """Archivo del almacén de este proceso (máquina y pid), para que dos procesos no se sobrescriban"""
+    return f"{METRICS_DIR}/metrics_store_{socket.gethostname()}_{os.getpid()}.json"
+
+
+def file_type_of(source: str) -> str:
+    """Tipo de archivo a partir de la extensión (o 'url' para fuentes remotas)"""
+    if source.startswith(("http://", "https://")):
+        return "url"
+    return Path(source).suffix.lower().lstrip(".") or "unknown"
+
+
+class LatencyHistogram:
+    """Histograma de latencias con cubetas fijas; dos histogramas se combinan sumando sus cubetas"""
+
+    def __init__(self, counts: Optional[List[int]] = None):
+        self.counts = list(counts) if counts else [0] * (len(LATENCY_BOUNDS) + 1)
+
+    def add(self, seconds: float):
+        """Añade una observación"""
+        for i, bound in enumerate(LATENCY_BOUNDS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def merge(self, other: "LatencyHistogram"):
+        """Suma otro histograma a este"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Percentil aproximado (límite superior de la cubeta que lo contiene)"""
+        total = sum(self.counts)
+        if total == 0:
+            return None
+
+        target = math.ceil(total * p / 100)
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return LATENCY_BOUNDS[i] if i < len(LATENCY_BOUNDS) else float("inf")
+        return float("inf")
+
+
+def _empty_bucket() -> Dict[str, Any]:
+    """Contadores vacíos de una cubeta de tiempo"""
+    return {
+        "count": 0,
+        "success": 0,
+        "failures": 0,
+        "processing_time_seconds": 0.0,
+        "characters": 0,
+        "words": 0,
+        "pages": 0,
+        "latency": LatencyHistogram(),
+    }
+
+
+class MetricsStore:
+    """
+    Métricas agregadas por intervalo (horario y diario) y dimensiones.
+    Las cubetas horarias se conservan hourly_retention_hours y las diarias daily_retention_days;
+    las más antiguas se descartan, así que el tamaño del almacén está acotado.
+    Cada proceso debe usar su propio archivo: save() sobrescribe el archivo con el contenido
+    en memoria. Para ver varios procesos o máquinas juntos, se combinan con merge() o load_combined().
+    Con path=None el almacén solo vive en memoria; con load=False se empieza vacío aunque el archivo exista.
+    """
+
+    DIMENSIONS = ("method", "file_type", "size_class")
+
+    def __init__(self, path: Optional[str] = "results/metrics_store.json", hourly_retention_hours: int = 72,
+                 daily_retention_days: int = 400, load: bool = True):
+        self.path = Path(path) if path else None
+        self.retention = {
+            "hourly": timedelta(hours=hourly_retention_hours),
+            "daily": timedelta(days=daily_retention_days),
+        }
+        self.buckets: Dict[Tuple[str, str, str, str, str], Dict[str, Any]] = {}
+        self.imported_files: List[str] = []   # logs JSONL ya importados (ver import_metrics_jsonl)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._last_save = 0.0
+        if load:
+            self.load()
+
+    def record(self, method: str, source: str, success: bool, processing_time: float = 0.0,
+               characters: int = 0, words: int = 0, pages: int = 0, size_bytes: Optional[int] = None,
+               timestamp: Optional[datetime] = None):
+        """Registra un documento procesado"""
+        timestamp = timestamp or datetime.now()
+        dims = (method, file_type_of(source), size_class(size_bytes))
+
+        with self._lock:
+            for resolution, fmt in RESOLUTIONS.items():
+                key = (resolution, timestamp.strftime(fmt)) + dims
+                bucket = self.buckets.setdefault(key, _empty_bucket())
+                bucket["count"] += 1
+                if success:
+                    bucket["success"] += 1
+                    bucket["processing_time_seconds"] += processing_time
+                    bucket["characters"] += characters
+                    bucket["words"] += words
+                    bucket["pages"] += pages
+                    bucket["latency"].add(processing_time)
+                else:
+                    bucket["failures"] += 1
+
+    def merge(self, other: "MetricsStore"):
+        """Combina las cubetas de otro almacén (p. ej. de otra máquina)"""
+        with self._lock:
+            self.imported_files = sorted(set(self.imported_files) | set(other.imported_files))
+            for key, other_bucket in other.buckets.items():
+                bucket = self.buckets.setdefault(key, _empty_bucket())
+                for field, value in other_bucket.items():
+                    if field == "latency":
+                        bucket["latency"].merge(value)
+                    else:
+                        bucket[field] += value
+
+    def prune(self, now: Optional[datetime] = None):
+        """Elimina las cubetas fuera del periodo de retención"""
+        now = now or datetime.now()
+        cutoffs = {resolution: (now - keep).strftime(RESOLUTIONS[resolution])
+                   for resolution, keep in self.retention.items()}
+
+        with self._lock:
+            expired = [key for key in self.buckets if key[1] < cutoffs[key[0]]]
+            for key in expired:
+                del self.buckets[key]
+
+    def summary(self, resolution: str = "daily", since: Optional[datetime] = None,
+                group_by: Tuple[str, ...] = ()) -> Dict[str, Dict[str, Any]]:
+        """
+        Estadísticas agregadas, opcionalmente agrupadas por 'period' y/o por las dimensiones.
+        El coste depende del número de cubetas, no del número de documentos.
+        """
+        since_key = since.strftime(RESOLUTIONS[resolution]) if since else ""
+        groups: Dict[str, Dict[str, Any]] = {}
+
+        with self._lock:
+            for key, bucket in self.buckets.items():
+                if key[0] != resolution or key[1] < since_key:
+                    continue
+
+                values = dict(zip(("period",) + self.DIMENSIONS, key[1:]))
+                group_key = "|".join(values[field] for field in group_by) or "total"
+                group = groups.setdefault(group_key, _empty_bucket())
+                for field, value in bucket.items():
+                    if field == "latency":
+                        group["latency"].merge(value)
+                    else:
+                        group[field] += value
+
+        return {group_key: self._stats(group) for group_key, group in sorted(groups.items())}
+
+    @staticmethod
+    def _stats(bucket: Dict[str, Any]) -> Dict[str, Any]:
+        """Convierte los contadores de una cubeta en estadísticas legibles"""
+        success = bucket["success"]
+        total_time = bucket["processing_time_seconds"]
+        return {
+            "total_files": bucket["count"],
+            "successful_files": success,
+            "failed_files": bucket["failures"],
+            "success_rate": (success / bucket["count"] * 100) if bucket["count"] else 0,
+            "average_time": total_time / success if success else 0,
+            "p50_time": bucket["latency"].percentile(50),
+            "p90_time": bucket["latency"].percentile(90),
+            "p99_time": bucket["latency"].percentile(99),
+            "average_words": bucket["words"] / success if success else 0,
+            "chars_per_second": bucket["characters"] / total_time if total_time else 0,
+            "total_characters": bucket["characters"],
+            "total_pages": bucket["pages"],
+        }
+
+    def load(self):
+        """Carga el almacén desde disco si existe"""
+        if self.path is None or not self.path.exists():
+            return
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if data.get("latency_bounds") != LATENCY_BOUNDS:
+            print("⚠️ Los límites del histograma han cambiado; se ignoran las métricas guardadas")
+            return
+
+        fields = data["fields"]
+        for row in data["buckets"]:
+            key = tuple(row[:5])
+            bucket = dict(zip(fields, row[5:]))
+            bucket["latency"] = LatencyHistogram(bucket["latency"])
+            self.buckets[key] = bucket
+        self.imported_files = data.get("imported_files", [])
+
+    def save(self):
+        """Guarda el almacén en disco en formato compacto (una fila por cubeta)"""
+        if self.path is None:
+            raise ValueError("El almacén no tiene archivo (path=None)")
+        self.prune()
+        fields = list(_empty_bucket().keys())
+
+        # Un solo guardado a la vez; la instantánea y la escritura van en el mismo orden
+        with self._save_lock:
+            with self._lock:
+                rows = []
+                for key, bucket in sorted(self.buckets.items()):
+                    values = [bucket[field].counts if field == "latency" else bucket[field] for field in fields]
+                    rows.append(list(key) + values)
+
+            data = {"latency_bounds": LATENCY_BOUNDS, "fields": fields, "buckets": rows,
+                    "imported_files": self.imported_files}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            tmp_path.replace(self.path)
+            self._last_save = time.monotonic()
+
+    def save_if_due(self, interval: float) -> bool:
+        """Guarda solo si han pasado 'interval' segundos desde el último guardado"""
+        if time.monotonic() - self._last_save < interval:
+            return False
+        self.save()
+        return True
+
+
+def load_combined(pattern: str = f"{METRICS_DIR}/*.json") -> MetricsStore:
+    """Combina en memoria los almacenes de todos los procesos que coinciden con el patrón"""
+    combined = MetricsStore(None)
+    for path in sorted(glob.glob(pattern)):
+        combined.merge(MetricsStore(path))
+    return combined
+
+
+def import_metrics_jsonl(metrics_file: str = "results/processing_metrics.jsonl",
+                         store: Optional[MetricsStore] = None) -> MetricsStore:
+    """
+    Importa (línea a línea, sin cargarlo entero) el log JSONL de MonitoredOCRProcessor.
+    Sin store se importa en un almacén vacío propio del log (METRICS_DIR/imported_<log>.json),
+    que se reescribe entero al repetir la importación. Un store existente recuerda qué logs
+    ha importado y no vuelve a sumar el mismo.
+    """
+    if store is None:
+        store = MetricsStore(f"{METRICS_DIR}/imported_{Path(metrics_file).stem}.json", load=False)
+
+    log_id = str(Path(metrics_file).resolve())
+    if log_id in store.imported_files:
+        print(f"⚠️ {metrics_file} ya se importó en este almacén; se omite")
+        return store
+
+    with open(metrics_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            metrics = json.loads(line)
+            file_path = metrics.get("file_path", "")
+            size_bytes = Path(file_path).stat().st_size if file_path and Path(file_path).exists() else None
+            store.record(
+                method=metrics.get("method", "local"),
+                source=file_path,
+                success=metrics.get("success", False),
+                processing_time=metrics.get("processing_time_seconds", 0.0),
+                characters=metrics.get("character_count", 0),
+                words=metrics.get("word_count", 0),
+                size_bytes=size_bytes,
+                timestamp=datetime.fromisoformat(metrics["timestamp"]),
+            )
+
+    store.imported_files.append(log_id)
+    return store
+
+
+class MetricsOCRProcessor(MistralOCRProcessor):
+    """
+    Procesador OCR que registra cada documento en un MetricsStore.
+    Por defecto cada proceso usa su propio archivo en METRICS_DIR (ver default_store_path).
+    El almacén se guarda como mucho cada save_interval segundos y al salir del programa.
+    """
+
+    def __init__(self, *args, metrics_store: Optional[MetricsStore] = None, save_interval: float = 10, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics_store = metrics_store or MetricsStore(default_store_path())
+        self.save_interval = save_interval
+        atexit.register(self.flush_metrics)
+
+    def flush_metrics(self):
+        """Guarda en disco las métricas pendientes"""
+        try:
+            self.metrics_store.save()
+        except Exception as e:
+            print(f"⚠️ No se pudieron guardar las métricas: {e}")
+
+    def _measured(self, method: str, source: str, call, *args):
+        start_time = datetime.now()
+        size_bytes = Path(source).stat().st_size if method != "url" and Path(source).exists() else None
+        response = None
+
+        try:
+            response = call(*args)
+            return response
+        finally:
+            # Las métricas nunca deben sustituir el resultado del OCR por una excepción
+            try:
+                processing_time = (datetime.now() - start_time).total_seconds()
+                text = self.extract_text_content(response) if response else ""
+                self.metrics_store.record(
+                    method=method,
+                    source=source,
+                    success=bool(response),
+                    processing_time=processing_time,
+                    characters=len(text),
+                    words=len(text.split()),
+                    pages=len(get_pages(response)) if response else 0,
+                    size_bytes=size_bytes,
+                    timestamp=start_time,
+                )
+                self.metrics_store.save_if_due(self.save_interval)
+            except Exception as e:
+                print(f"⚠️ No se pudieron registrar las métricas de {source}: {e}")
+
+    def process_local_file(self, file_path: str):
+        return self._measured("local", file_path, super().process_local_file, file_path)
+
+    def upload_and_process_file(self, file_path: str):
+        return self._measured("upload", file_path, super().upload_and_process_file, file_path)
+
+    def process_document_from_url(self, url: str, document_type: str = "document_url"):
+        return self._measured("url", url, super().process_document_from_url, url, document_type)
+
+
+def generate_metrics_dashboard(store_path: Optional[str] = None, days: int = 30):
+    """
+    Genera el dashboard de métricas a partir de las cubetas diarias del almacén.
+    Sin store_path se combinan los almacenes de todos los procesos de METRICS_DIR.
+    """
+    import matplotlib.pyplot as plt
+
+    store = MetricsStore(store_path) if store_path else load_combined()
+    since = datetime.now() - timedelta(days=days)
+    totals = store.summary("daily", since)
+
+    if not totals or totals["total"]["total_files"] == 0:
+        print("📊 No hay métricas disponibles")
+        return
+
+    by_day = store.summary("daily", since, group_by=("period",))
+    by_method = store.summary("daily", since, group_by=("method",))
+    by_size = store.summary("daily", since, group_by=("size_class",))
+
+    fig, axes = plt.subplots(2, 2, figsize=(15, 10))
+    fig.suptitle('Dashboard de Métricas OCR', fontsize=16)
+
+    # Gráfico 1: Documentos por día
+    days_labels = list(by_day.keys())
+    axes[0, 0].bar(days_labels, [s["total_files"] for s in by_day.values()])
+    axes[0, 0].set_xlabel('Día')
+    axes[0, 0].set_ylabel('Documentos')
+    axes[0, 0].set_title('Documentos Procesados por Día')
+    axes[0, 0].tick_params(axis='x', rotation=45)
+
+    # Gráfico 2: Percentiles de latencia por método
+    methods = list(by_method.keys())
+    for offset, percentile in enumerate(("p50_time", "p90_time", "p99_time")):
+        values = [by_method[m][percentile] or 0 for m in methods]
+        axes[0, 1].bar([i + offset * 0.25 for i in range(len(methods))], values, width=0.25,
+                       label=percentile.split('_')[0])
+    axes[0, 1].set_xticks([i + 0.25 for i in range(len(methods))])
+    axes[0, 1].set_xticklabels(methods)
+    axes[0, 1].set_ylabel('Tiempo (segundos)')
+    axes[0, 1].set_title('Latencia por Método')
+    axes[0, 1].legend()
+
+    # Gráfico 3: Velocidad de procesamiento por día
+    axes[1, 0].plot(days_labels, [s["chars_per_second"] for s in by_day.values()], marker='o')
+    axes[1, 0].set_xlabel('Día')
+    axes[1, 0].set_ylabel('Caracteres/Segundo')
+    axes[1, 0].set_title('Velocidad de Procesamiento')
+    axes[1, 0].tick_params(axis='x', rotation=45)
+
+    # Gráfico 4: Documentos por tamaño
+    axes[1, 1].pie([s["total_files"] for s in by_size.values()], labels=list(by_size.keys()), autopct='%1.1f%%')
+    axes[1, 1].set_title('Documentos por Tamaño')
+
+    plt.tight_layout()
+    plt.savefig('results/metrics_dashboard.png', dpi=300, bbox_inches='tight')
+    plt.show()
+
+    stats = totals["total"]
+    print(f"\n📊 Estadísticas de Procesamiento (últimos {days} días):")
+    print(f"  📄 Total de archivos procesados: {stats['total_files']}")
+    print(f"  ✅ Procesamientos exitosos: {stats['successful_files']}")
+    print(f"  ❌ Procesamientos fallidos: {stats['failed_files']}")
+    print(f"  ⏱️ Tiempo promedio: {stats['average_time']:.2f}s (p50 {stats['p50_time']}s, p99 {stats['p99_time']}s)")
+    print(f"  📝 Palabras promedio: {stats['average_words']:.0f}")
+    print(f"  ⚡ Velocidad promedio: {stats['chars_per_second']:.0f} chars/s")
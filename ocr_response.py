@@ -0,0 +1,107 @@
+"""
+Utilidades para leer respuestas de Mistral OCR
+Funcionan igual con el objeto devuelto por el SDK y con el JSON guardado en results/
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, List
+from urllib.parse import urlparse
+
+
+def get_field(obj: Any, key: str, default: Any = None) -> Any:
+    """Lee un campo tanto de un dict como de un objeto del SDK"""
+    if obj is None:
+        return default
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+
+def get_pages(response: Any) -> List[Any]:
+    """Devuelve la lista de páginas de una respuesta OCR"""
+    return list(get_field(response, "pages", None) or [])
+
+
+def page_markdown(page: Any) -> str:
+    """Devuelve el markdown de una página (cadena vacía si no tiene)"""
+    return get_field(page, "markdown", "") or ""
+
+
+def response_to_dict(response: Any) -> Dict[str, Any]:
+    """Convierte una respuesta OCR en un dict serializable a JSON"""
+    if isinstance(response, dict):
+        return response
+    if hasattr(response, "model_dump"):
+        return response.model_dump()
+    if hasattr(response, "dict"):
+        return response.dict()
+    return dict(vars(response))
+
+
+def set_field(obj: Any, key: str, value: Any):
+    """Asigna un campo tanto en un dict como en un objeto del SDK"""
+    if isinstance(obj, dict):
+        obj[key] = value
+    else:
+        setattr(obj, key, value)
+
+
+def result_filename_for(source: str) -> str:
+    """Nombre de archivo de resultados único y estable para una fuente (ruta o URL)"""
+    name = Path(urlparse(source).path).stem or "document"
+    digest = hashlib.sha1(source.encode("utf-8")).hexdigest()[:8]
+    return f"{name}_{digest}_ocr.json"
+
+
+class DictResponseMixin:
+    """
+    Permite que extract_text_content, analyze_document_structure y save_results acepten
+    respuestas en forma de dict (las que se componen localmente con páginas de varias fuentes).
+    Las respuestas del SDK siguen pasando por la implementación del procesador.
+    El tipo de documento se toma del campo 'document_type' que añade quien compone la respuesta.
+    """
+
+    results_folder = "results"
+
+    def extract_text_content(self, response) -> str:
+        if not isinstance(response, dict):
+            return super().extract_text_content(response)
+        return "\n\n".join(page_markdown(page) for page in get_pages(response))
+
+    def analyze_document_structure(self, response) -> Dict[str, Any]:
+        if not isinstance(response, dict):
+            return super().analyze_document_structure(response)
+
+        text = self.extract_text_content(response)
+        pages = get_pages(response)
+        provenance: Dict[str, int] = {}
+        for page in pages:
+            source = get_field(page, "provenance", "ocr")
+            provenance[source] = provenance.get(source, 0) + 1
+
+        return {
+            "total_characters": len(text),
+            "total_words": len(text.split()),
+            "total_lines": len(text.split("\n")),
+            "total_pages": len(pages),
+            "has_images": any(get_field(page, "images", None) for page in pages),
+            "page_provenance": provenance,
+            "document_type": response.get("document_type", "unknown"),
+            "processing_time": "unknown",
+        }
+
+    def save_results(self, response, filename: str):
+        if not isinstance(response, dict):
+            return super().save_results(response, filename)
+
+        results_path = Path(self.results_folder)
+        results_path.mkdir(exist_ok=True)
+        result_file = results_path / filename
+
+        with open(result_file, "w", encoding="utf-8") as f:
+            json.dump(response, f, ensure_ascii=False, indent=2)
+
+        print(f"💾 Resultados guardados en: {result_file}")
+        return result_file
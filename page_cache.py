@@ -0,0 +1,291 @@
+"""
+Re-OCR incremental a nivel de página
+Cada página de un PDF se identifica por un hash de su contenido (flujo de contenido,
+imágenes y formularios embebidos, anotaciones, tamaño y rotación). Al reprocesar un documento revisado
+solo se envían a OCR las páginas nuevas o modificadas, en un único sub-documento,
+y el resto se recupera del almacén de páginas por su hash.
+Los resultados se guardan por (hash de página, variante): la variante incluye el modelo y
+las opciones de OCR, de modo que al cambiar cualquiera de ellos las páginas se vuelven a procesar.
+"""
+
+import hashlib
+import json
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Añadir src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from src.ocr_processor import MistralOCRProcessor
+from ocr_response import DictResponseMixin, get_pages, response_to_dict
+from pdf_routing import ocr_pdf_pages
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.avif')
+# Campos de una anotación que cambian lo que se ve (valor de formulario, sello, estado de casilla...)
+ANNOTATION_KEYS = ('/Subtype', '/Rect', '/F', '/FT', '/T', '/V', '/AS', '/Contents')
+
+
+def _hash_stream_data(obj, digest, seen: set):
+    """Añade al hash los datos de un XObject (imagen o formulario) y de sus recursos anidados"""
+    obj = obj.get_object()
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+
+    if hasattr(obj, "get_data"):
+        digest.update(obj.get_data())
+
+    resources = obj.get("/Resources") if hasattr(obj, "get") else None
+    if resources:
+        _hash_resources(resources, digest, seen)
+
+
+def _hash_resources(resources, digest, seen: set):
+    """Añade al hash los XObjects y los nombres de fuentes de un diccionario de recursos"""
+    resources = resources.get_object()
+
+    fonts = resources.get("/Font")
+    if fonts:
+        for name, font in sorted(fonts.get_object().items()):
+            digest.update(f"{name}:{font.get_object().get('/BaseFont')}".encode("utf-8"))
+
+    xobjects = resources.get("/XObject")
+    if xobjects:
+        for name, xobject in sorted(xobjects.get_object().items()):
+            digest.update(name.encode("utf-8"))
+            _hash_stream_data(xobject, digest, seen)
+
+
+def _hash_annotations(annotations, digest, seen: set):
+    """
+    Añade al hash las anotaciones de una página: valores de formulario (también los heredados
+    del campo padre), sellos, firmas y sus flujos de apariencia, que es lo que se renderiza
+    """
+    for annotation in annotations.get_object():
+        annotation = annotation.get_object()
+        parent = annotation.get("/Parent")
+        field = parent.get_object() if parent else {}
+
+        for key in ANNOTATION_KEYS:
+            value = annotation.get(key, field.get(key))
+            if hasattr(value, "get_object"):
+                value = value.get_object()
+            digest.update(f"{key}={value}".encode("utf-8"))
+
+        appearance = annotation.get("/AP")
+        if not appearance:
+            continue
+        for kind, streams in sorted(appearance.get_object().items()):
+            digest.update(kind.encode("utf-8"))
+            streams = streams.get_object()
+            if hasattr(streams, "get_data"):
+                _hash_stream_data(streams, digest, seen)
+            else:
+                # Un flujo por estado (p. ej. /On y /Off de una casilla)
+                for state, stream in sorted(streams.items()):
+                    digest.update(state.encode("utf-8"))
+                    _hash_stream_data(stream, digest, seen)
+
+
+def page_content_hash(page) -> str:
+    """Hash del contenido visible de una página PDF (independiente del resto del documento)"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([float(v) for v in page.mediabox]).encode("utf-8"))
+    digest.update(str(page.get("/Rotate", 0)).encode("utf-8"))
+
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+
+    seen = set()
+    resources = page.get("/Resources")
+    if resources:
+        _hash_resources(resources, digest, seen)
+
+    annotations = page.get("/Annots")
+    if annotations:
+        _hash_annotations(annotations, digest, seen)
+
+    return digest.hexdigest()
+
+
+def page_variant(model: Optional[str] = None, options: Optional[Dict[str, Any]] = None) -> str:
+    """Identificador de la configuración de OCR que produjo un resultado (modelo y opciones)"""
+    return json.dumps({"model": model, "options": options or {}}, sort_keys=True)
+
+
+def pdf_page_hashes(pdf_path: str) -> List[str]:
+    """Hash de contenido de cada página de un PDF"""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(pdf_path)
+    return [page_content_hash(page) for page in reader.pages]
+
+
+class PageResultStore:
+    """Almacén SQLite de resultados OCR por hash de página y variante (modelo y opciones)"""
+
+    def __init__(self, db_path: str = "results/page_cache.db"):
+        self.db_path = db_path
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.init_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def init_database(self):
+        """Inicializa la base de datos"""
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS page_variant_results (
+                page_hash TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                page_json TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (page_hash, variant)
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def get_many(self, page_hashes: List[str], variant: str) -> Dict[str, Dict[str, Any]]:
+        """Páginas guardadas para los hashes indicados, producidas con la variante indicada"""
+        unique_hashes = list(dict.fromkeys(page_hashes))
+        found = {}
+        conn = self._connect()
+
+        # SQLite limita el número de parámetros por consulta
+        for start in range(0, len(unique_hashes), 500):
+            batch = unique_hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            cursor = conn.execute(f"SELECT page_hash, page_json FROM page_variant_results "
+                                  f"WHERE variant = ? AND page_hash IN ({placeholders})", [variant] + batch)
+            found.update((page_hash, json.loads(page_json)) for page_hash, page_json in cursor.fetchall())
+
+        conn.close()
+        return found
+
+    def put_many(self, pages: Dict[str, Dict[str, Any]], variant: str):
+        """Guarda páginas OCR por hash para una variante"""
+        conn = self._connect()
+        conn.executemany(
+            "INSERT OR REPLACE INTO page_variant_results (page_hash, variant, page_json) VALUES (?, ?, ?)",
+            [(page_hash, variant, json.dumps(page, ensure_ascii=False)) for page_hash, page in pages.items()],
+        )
+        conn.commit()
+        conn.close()
+
+
+def incremental_pdf_ocr(pdf_path: str, ocr_file, store: PageResultStore, model: Optional[str] = None,
+                        options: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    OCR de un PDF reutilizando las páginas ya conocidas para el mismo modelo y opciones.
+    Las páginas sin resultado (una por hash distinto) se envían juntas a OCR;
+    las demás se insertan desde el almacén en su índice original.
+    """
+    variant = page_variant(model, options)
+    page_hashes = pdf_page_hashes(pdf_path)
+    cached = store.get_many(page_hashes, variant)
+
+    # Una sola página representativa por hash nuevo (p. ej. páginas en blanco repetidas)
+    pending: Dict[str, int] = {}
+    for index, page_hash in enumerate(page_hashes):
+        if page_hash not in cached and page_hash not in pending:
+            pending[page_hash] = index
+
+    print(f"🧩 {Path(pdf_path).name}: {len(page_hashes)} páginas, "
+          f"{len(page_hashes) - len(pending)} desde caché, {len(pending)} a OCR")
+
+    ocr_result = {}
+    if pending:
+        ocr_result = ocr_pdf_pages(ocr_file, pdf_path, list(pending.values()), len(page_hashes))
+        if not ocr_result:
+            return None
+
+        new_pages = {page_hash: ocr_result["pages"][index]
+                     for page_hash, index in pending.items() if index in ocr_result["pages"]}
+        store.put_many(new_pages, variant)
+        cached.update(new_pages)
+
+    pages = []
+    for index, page_hash in enumerate(page_hashes):
+        page = dict(cached.get(page_hash) or {"markdown": "", "images": [], "dimensions": None})
+        page["index"] = index
+        page["page_hash"] = page_hash
+        page["provenance"] = "ocr" if pending.get(page_hash) == index else "page_cache"
+        pages.append(page)
+
+    usage_info = dict(ocr_result.get("usage_info") or {})
+    usage_info["cached_pages"] = len(page_hashes) - len(pending)
+    usage_info["ocr_pages"] = len(pending)
+
+    return {
+        "pages": pages,
+        "model": ocr_result.get("model") or model,
+        "usage_info": usage_info,
+        "document_type": "pdf",
+    }
+
+
+class IncrementalOCRProcessor(DictResponseMixin, MistralOCRProcessor):
+    """
+    Procesador OCR con almacén de páginas: al reprocesar un PDF solo se envían las páginas cambiadas.
+    ocr_options describe cualquier ajuste del procesador que cambie el resultado (p. ej. si incluye
+    las imágenes en base64); solo forma parte de la clave de caché junto con el modelo y nunca
+    se envía al API.
+    """
+
+    def __init__(self, *args, page_store: Optional[PageResultStore] = None,
+                 ocr_options: Optional[Dict[str, Any]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.page_store = page_store or PageResultStore()
+        self.ocr_options = ocr_options or {}
+
+    @property
+    def page_variant(self) -> str:
+        return page_variant(getattr(self, "model", None), self.ocr_options)
+
+    def process_local_file(self, file_path: str):
+        extension = Path(file_path).suffix.lower()
+
+        if extension == ".pdf":
+            from PyPDF2.errors import PyPdfError
+
+            try:
+                return incremental_pdf_ocr(file_path, super().process_local_file, self.page_store,
+                                           getattr(self, "model", None), self.ocr_options)
+            except PyPdfError as e:
+                print(f"⚠️ No se pudieron leer las páginas de {Path(file_path).name} ({e}); se usa OCR completo")
+                return super().process_local_file(file_path)
+
+        if extension in IMAGE_EXTENSIONS:
+            return self._process_single_page(file_path)
+
+        # DOCX/PPTX no se pueden dividir en páginas localmente
+        return super().process_local_file(file_path)
+
+    def _process_single_page(self, file_path: str):
+        """Imágenes: una sola página, identificada por el hash del archivo"""
+        page_hash = hashlib.sha256(Path(file_path).read_bytes()).hexdigest()
+        cached = self.page_store.get_many([page_hash], self.page_variant).get(page_hash)
+
+        if cached is None:
+            response = super().process_local_file(file_path)
+            if not response:
+                return response
+            data = response_to_dict(response)
+            pages = get_pages(data)
+            if pages:
+                self.page_store.put_many({page_hash: pages[0]}, self.page_variant)
+            return response
+
+        print(f"🧩 {Path(file_path).name}: resultado desde caché")
+        page = dict(cached)
+        page["index"] = 0
+        page["page_hash"] = page_hash
+        page["provenance"] = "page_cache"
+        return {"pages": [page], "model": getattr(self, "model", None),
+                "usage_info": {"cached_pages": 1, "ocr_pages": 0},
+                "document_type": Path(file_path).suffix.lower().lstrip(".")}
@@ -0,0 +1,219 @@
+"""
+Enrutado híbrido de PDFs: capa de texto nativa primero, OCR solo donde hace falta
+Las páginas con una capa de texto utilizable se extraen localmente con PyPDF2 (en paralelo);
+las páginas escaneadas o con texto de baja calidad se envían juntas a Mistral OCR en un
+único sub-documento. El resultado mantiene la forma normal de la respuesta, con el origen
+de cada página en el campo 'provenance'.
+"""
+
+import os
+import re
+import sys
+import tempfile
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Añadir src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from src.ocr_processor import MistralOCRProcessor
+from ocr_response import DictResponseMixin, get_field, get_pages, response_to_dict
+
+MIN_PAGE_CHARS = 100         # menos caracteres suele indicar página escaneada
+MIN_ALNUM_RATIO = 0.6        # proporción mínima de letras/números entre los caracteres no blancos
+MAX_GARBAGE_RATIO = 0.02     # proporción máxima de caracteres de reemplazo o glifos sin mapear
+PARALLEL_MIN_PAGES = 16      # por debajo no compensa arrancar procesos
+
+GARBAGE_RE = re.compile(r"�|\(cid:\d+\)|[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def text_layer_quality(text: str) -> Dict[str, Any]:
+    """Mide la calidad de la capa de texto de una página y decide si es utilizable"""
+    compact = re.sub(r"\s+", "", text)
+    chars = len(compact)
+    alnum_ratio = sum(c.isalnum() for c in compact) / chars if chars else 0.0
+    garbage_ratio = len(GARBAGE_RE.findall(text)) / chars if chars else 0.0
+
+    return {
+        "characters": chars,
+        "alnum_ratio": round(alnum_ratio, 3),
+        "garbage_ratio": round(garbage_ratio, 3),
+        "usable": chars >= MIN_PAGE_CHARS and alnum_ratio >= MIN_ALNUM_RATIO and garbage_ratio <= MAX_GARBAGE_RATIO,
+    }
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extrae el texto de un rango de páginas (se ejecuta en un proceso aparte)"""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(pdf_path)
+    return [(index, reader.pages[index].extract_text() or "") for index in range(start, end)]
+
+
+def extract_text_layer(pdf_path: str, workers: Optional[int] = None,
+                       executor: Optional[Callable[[], Executor]] = None) -> List[str]:
+    """
+    Texto nativo de todas las páginas, repartiendo rangos de páginas entre núcleos.
+    executor devuelve un pool de procesos compartido; sin él se crea uno para este PDF.
+    """
+    from PyPDF2 import PdfReader
+
+    page_count = len(PdfReader(pdf_path).pages)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or page_count < PARALLEL_MIN_PAGES:
+        return [text for _, text in _extract_page_range(pdf_path, 0, page_count)]
+
+    step = -(-page_count // workers)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    texts = [""] * page_count
+
+    def collect(pool: Executor):
+        futures = [pool.submit(_extract_page_range, pdf_path, start, end) for start, end in ranges]
+        for future in futures:
+            for index, text in future.result():
+                texts[index] = text
+
+    if executor:
+        collect(executor())
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            collect(pool)
+
+    return texts
+
+
+def write_pdf_subset(pdf_path: str, page_indices: List[int], output_path: str):
+    """Escribe un PDF con solo las páginas indicadas, en ese orden"""
+    from PyPDF2 import PdfReader, PdfWriter
+
+    reader = PdfReader(pdf_path)
+    writer = PdfWriter()
+    for index in page_indices:
+        writer.add_page(reader.pages[index])
+
+    with open(output_path, "wb") as f:
+        writer.write(f)
+
+
+def ocr_pdf_pages(ocr_file: Callable[[str], Any], pdf_path: str, page_indices: List[int],
+                  total_pages: int) -> Dict[str, Any]:
+    """
+    Envía solo las páginas indicadas a OCR en un único sub-documento y devuelve
+    {'pages': {índice original: página}, 'model': ..., 'usage_info': ...}.
+    Si son todas las páginas se envía el archivo original.
+    """
+    if len(page_indices) == total_pages:
+        response = ocr_file(pdf_path)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            subset_path = str(Path(tmp_dir) / f"{Path(pdf_path).stem}_pages.pdf")
+            write_pdf_subset(pdf_path, page_indices, subset_path)
+            response = ocr_file(subset_path)
+
+    if not response:
+        return {}
+
+    data = response_to_dict(response)
+    pages = {}
+    for position, page in enumerate(get_pages(data)):
+        sub_index = get_field(page, "index", position)
+        if sub_index < len(page_indices):
+            pages[page_indices[sub_index]] = page
+
+    return {"pages": pages, "model": data.get("model"), "usage_info": data.get("usage_info")}
+
+
+def route_pdf(pdf_path: str, ocr_file: Callable[[str], Any], workers: Optional[int] = None,
+              model: Optional[str] = None,
+              executor: Optional[Callable[[], Executor]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Procesa un PDF combinando capa de texto nativa y OCR (ocr_file procesa un PDF local).
+    Devuelve una respuesta en forma de dict con las páginas en su orden original,
+    o None si alguna página necesitaba OCR y el OCR falló.
+    """
+    texts = extract_text_layer(pdf_path, workers, executor)
+    qualities = [text_layer_quality(text) for text in texts]
+    ocr_indices = [index for index, quality in enumerate(qualities) if not quality["usable"]]
+
+    print(f"🧭 {Path(pdf_path).name}: {len(texts) - len(ocr_indices)} páginas con capa de texto, "
+          f"{len(ocr_indices)} a OCR")
+
+    ocr_result = ocr_pdf_pages(ocr_file, pdf_path, ocr_indices, len(texts)) if ocr_indices else {}
+    if ocr_indices and not ocr_result:
+        return None
+
+    pages = []
+    for index, (text, quality) in enumerate(zip(texts, qualities)):
+        ocr_page = ocr_result.get("pages", {}).get(index) if not quality["usable"] else None
+
+        if ocr_page is not None:
+            page = dict(ocr_page)
+            page["index"] = index
+            page["provenance"] = "ocr"
+        else:
+            page = {"index": index, "markdown": text.strip(), "images": [], "dimensions": None,
+                    "provenance": "text_layer" if quality["usable"] else "text_layer_fallback"}
+
+        page["text_layer_quality"] = quality
+        pages.append(page)
+
+    usage_info = dict(ocr_result.get("usage_info") or {})
+    usage_info["text_layer_pages"] = len(texts) - len(ocr_indices)
+    usage_info["ocr_pages"] = len(ocr_indices)
+
+    return {
+        "pages": pages,
+        "model": ocr_result.get("model") or model,
+        "usage_info": usage_info,
+        "document_type": "pdf",
+    }
+
+
+class HybridPDFOCRProcessor(DictResponseMixin, MistralOCRProcessor):
+    """
+    Procesador OCR que usa la capa de texto de los PDF y solo hace OCR de las páginas que lo necesitan.
+    Los PDF largos comparten un único pool de procesos, creado la primera vez que hace falta
+    y cerrado con close() (o al salir del programa).
+    """
+
+    def __init__(self, *args, text_workers: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.text_workers = text_workers
+        self._text_executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def _text_pool(self) -> ProcessPoolExecutor:
+        """Pool de procesos compartido para extraer la capa de texto (se crea al primer uso)"""
+        with self._executor_lock:
+            if self._text_executor is None:
+                self._text_executor = ProcessPoolExecutor(max_workers=self.text_workers or os.cpu_count() or 1)
+            return self._text_executor
+
+    def close(self):
+        """Cierra el pool de procesos de extracción de texto"""
+        with self._executor_lock:
+            executor, self._text_executor = self._text_executor, None
+        if executor:
+            executor.shutdown()
+
+    def process_local_file(self, file_path: str):
+        if Path(file_path).suffix.lower() != ".pdf":
+            return super().process_local_file(file_path)
+
+        from PyPDF2.errors import PyPdfError
+
+        try:
+            return route_pdf(file_path, super().process_local_file, self.text_workers,
+                             getattr(self, "model", None), self._text_pool)
+        except BrokenProcessPool as e:
+            # Un proceso del pool ha muerto (p. ej. sin memoria): se descarta el pool para los siguientes PDF
+            self.close()
+            print(f"⚠️ Falló la extracción de texto de {Path(file_path).name} ({e}); se usa OCR completo")
+            return super().process_local_file(file_path)
+        except PyPdfError as e:
+            print(f"⚠️ No se pudo leer la capa de texto de {Path(file_path).name} ({e}); se usa OCR completo")
+            return super().process_local_file(file_path)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Procesamiento OCR sin interfaz (headless) para usar en pipelines
+Lee rutas o URLs desde argumentos o stdin y emite una línea NDJSON por documento terminado
+
+Ejemplos:
+    find documents/inbox -name "*.pdf" | python stream_ocr.py --jobs 4
+    python stream_ocr.py --method url https://arxiv.org/pdf/2201.04234
+"""
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TextIO
+from urllib.parse import urlparse
+
+# Añadir src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from src.ocr_processor import MistralOCRProcessor
+from adaptive_concurrency import AdaptiveConcurrencyLimiter, AdaptiveOCRProcessor
+from columnar_export import ColumnarOCRProcessor
+from dedup_index import DedupIndex, DedupStage
+from image_store import IMAGE_MODES, ImageStore, apply_image_mode
+from metrics_store import MetricsStore
+from ocr_response import get_pages, result_filename_for
+
+METHODS = ("local", "upload", "url")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".avif")
+METRICS_SAVE_INTERVAL = 10  # segundos entre guardados del almacén de métricas
+
+
+def iter_sources(args_sources: Iterable[str], stdin: TextIO) -> Iterator[str]:
+    """Genera las fuentes a procesar: primero los argumentos y, si no hay o se pasa '-', stdin línea a línea"""
+    args_sources = list(args_sources)
+    use_stdin = not args_sources or "-" in args_sources
+
+    for source in args_sources:
+        if source != "-":
+            yield source
+
+    if use_stdin:
+        for line in stdin:
+            source = line.strip()
+            if source:
+                yield source
+
+
+def run_ocr(processor, source: str, method: str):
+    """Lanza el OCR con el método indicado"""
+    if method == "local":
+        return processor.process_local_file(source)
+    if method == "upload":
+        return processor.upload_and_process_file(source)
+
+    document_type = "image_url" if urlparse(source).path.lower().endswith(IMAGE_EXTENSIONS) else "document_url"
+    return processor.process_document_from_url(source, document_type)
+
+
+def process_source(processor, source: str, method: str, queued_at: float, save: bool = True,
+                   postprocess: Optional[Callable[[Any], None]] = None,
+                   dedup: Optional[DedupStage] = None) -> Dict[str, Any]:
+    """
+    Procesa una fuente y devuelve el registro NDJSON correspondiente.
+    postprocess recibe la respuesta antes de guardarla (p. ej. para externalizar imágenes).
+    dedup comprueba antes del OCR si el archivo es un duplicado de uno ya procesado.
+    """
+    started_at = time.time()
+    record = {
+        "source": source,
+        "method": method,
+        "success": False,
+        "started_at": datetime.fromtimestamp(started_at).isoformat(),
+        "timings": {"queue_seconds": round(started_at - queued_at, 3)},
+    }
+
+    try:
+        fingerprint = None
+        if dedup and method != "url":
+            fingerprint, match = dedup.check(source)
+            record["timings"]["dedup_seconds"] = round(time.time() - started_at, 3)
+
+            if match:
+                record["duplicate_of"] = match
+                if dedup.can_reuse(match):
+                    record["reused"] = True
+                    record["result_file"] = match["result_file"]
+                    record["success"] = True
+                    return record
+
+        ocr_started = time.time()
+        response = run_ocr(processor, source, method)
+        ocr_done = time.time()
+        record["timings"]["ocr_seconds"] = round(ocr_done - ocr_started, 3)
+
+        if not response:
+            record["error"] = "No response from API"
+            return record
+
+        if postprocess:
+            postprocess(response)
+
+        text = processor.extract_text_content(response)
+        record["pages"] = len(get_pages(response))
+        record["characters"] = len(text)
+        record["words"] = len(text.split())
+
+        if save:
+            record["result_file"] = str(processor.save_results(response, result_filename_for(source)))
+            record["timings"]["save_seconds"] = round(time.time() - ocr_done, 3)
+
+            if fingerprint:
+                dedup.register(source, fingerprint, record["result_file"])
+
+        record["success"] = True
+
+    except Exception as e:
+        record["error"] = str(e)
+
+    finally:
+        record["timings"]["total_seconds"] = round(time.time() - queued_at, 3)
+
+    return record
+
+
+def stream_process(processor, sources: Iterable[str], method: str = "local", jobs: int = 4,
+                   max_inflight: Optional[int] = None, save: bool = True,
+                   postprocess: Optional[Callable[[Any], None]] = None,
+                   dedup: Optional[DedupStage] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Procesa las fuentes concurrentemente y genera cada resultado en cuanto termina.
+    Nunca hay más de max_inflight documentos leídos y sin emitir, así que stdin se consume
+    al ritmo del procesamiento y la memoria no crece con el tamaño del lote.
+    """
+    max_inflight = max(max_inflight or jobs * 2, jobs)
+    source_iter = iter(sources)
+    pending = set()
+
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    exhausted = False
+
+    try:
+        while True:
+            while not exhausted and len(pending) < max_inflight:
+                source = next(source_iter, None)
+                if source is None:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(process_source, processor, source, method, time.time(), save,
+                                             postprocess, dedup))
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # Si se interrumpe (Ctrl-C o el consumidor deja de leer) los documentos en cola se cancelan
+        # para no pagar OCR cuyos resultados se descartarían; solo terminan los que ya están en curso
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def record_metrics(store: MetricsStore, record: Dict[str, Any]):
+    """Registra un resultado NDJSON en el almacén de métricas agregadas (los reutilizados no llaman al API)"""
+    if record.get("reused"):
+        return
+
+    source = record["source"]
+    size_bytes = None
+    if record["method"] != "url" and Path(source).is_file():
+        size_bytes = Path(source).stat().st_size
+
+    store.record(
+        method=record["method"],
+        source=source,
+        success=record["success"],
+        processing_time=record["timings"].get("ocr_seconds", 0.0),
+        characters=record.get("characters", 0),
+        words=record.get("words", 0),
+        pages=record.get("pages", 0),
+        size_bytes=size_bytes,
+        timestamp=datetime.fromisoformat(record["started_at"]),
+    )
+
+
+def write_record(record: Dict[str, Any], out: TextIO):
+    """Escribe un registro NDJSON y vacía el buffer para que el consumidor lo reciba al momento"""
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+
+
+def main(argv: Optional[list] = None) -> int:
+    """Punto de entrada del CLI"""
+    parser = argparse.ArgumentParser(description="Procesamiento OCR en streaming con salida NDJSON")
+    parser.add_argument("sources", nargs="*", help="Rutas o URLs a procesar ('-' o vacío para leer de stdin)")
+    parser.add_argument("--jobs", "-j", type=int, default=4, help="Documentos procesados en paralelo")
+    parser.add_argument("--method", "-m", choices=METHODS, default="local", help="Método de procesamiento")
+    parser.add_argument("--max-inflight", type=int, default=None,
+                        help="Máximo de documentos leídos pendientes de emitir (por defecto 2 x jobs)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Ajustar las llamadas simultáneas al API con AIMD (--jobs pasa a ser el máximo)")
+    parser.add_argument("--no-save", action="store_true", help="No guardar el JSON de resultados")
+    parser.add_argument("--parquet", metavar="DIR", default=None,
+                        help="Exportar también cada resultado guardado al dataset Parquet de DIR")
+    parser.add_argument("--images", choices=IMAGE_MODES, default="inline",
+                        help="Imágenes de la respuesta: conservar, descartar o guardar en disco deduplicadas")
+    parser.add_argument("--images-dir", default="results/images", help="Carpeta del almacén de imágenes")
+    parser.add_argument("--dedup-index", metavar="PATH", default=None,
+                        help="Índice SQLite de casi duplicados consultado antes de cada OCR")
+    parser.add_argument("--dedup-threshold", type=float, default=0.9,
+                        help="Similitud mínima (0-1) para considerar un documento duplicado")
+    parser.add_argument("--dedup-action", choices=DedupStage.ACTIONS, default="flag",
+                        help="Solo marcar los duplicados y procesarlos igualmente, reutilizar el resultado "
+                             "solo de los idénticos byte a byte o también de los casi duplicados")
+    parser.add_argument("--metrics-store", metavar="PATH", default=None,
+                        help="Registrar cada documento en el almacén de métricas agregadas de PATH")
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error("--jobs debe ser al menos 1")
+
+    # stdout queda reservado para el NDJSON; los mensajes del procesador van a stderr
+    ndjson_out = sys.stdout
+    sys.stdout = sys.stderr
+    failures = 0
+    limiter = None
+    metrics_store = MetricsStore(args.metrics_store) if args.metrics_store else None
+
+    postprocess = None
+    if args.images != "inline":
+        image_store = ImageStore(args.images_dir) if args.images == "store" else None
+        postprocess = partial(apply_image_mode, mode=args.images, store=image_store)
+
+    dedup = None
+    if args.dedup_index:
+        dedup = DedupStage(DedupIndex(args.dedup_index), args.dedup_threshold, args.dedup_action)
+
+    try:
+        if args.parquet:
+            processor = ColumnarOCRProcessor(parquet_dir=args.parquet)
+        else:
+            processor = MistralOCRProcessor()
+
+        if args.adaptive:
+            limiter = AdaptiveConcurrencyLimiter(initial_limit=min(4, args.jobs), max_limit=args.jobs)
+            processor = AdaptiveOCRProcessor(processor, limiter)
+
+        sources = iter_sources(args.sources, sys.stdin)
+        for record in stream_process(processor, sources, args.method, args.jobs,
+                                     args.max_inflight, not args.no_save, postprocess, dedup):
+            failures += not record["success"]
+            if limiter:
+                record["concurrency_limit"] = limiter.current_limit
+            write_record(record, ndjson_out)
+
+            if metrics_store:
+                record_metrics(metrics_store, record)
+                metrics_store.save_if_due(METRICS_SAVE_INTERVAL)
+
+    except ValueError as e:
+        print(f"❌ Error de configuración: {e}")
+        return 2
+    except KeyboardInterrupt:
+        print("\n⛔ Interrumpido")
+        return 130
+    finally:
+        if metrics_store:
+            metrics_store.save()
+        if limiter:
+            print(f"🎚️ Concurrencia adaptativa: {json.dumps(limiter.snapshot(), ensure_ascii=False)}")
+        sys.stdout = ndjson_out
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Cola de trabajo con leases sobre una bandeja de entrada compartida
+Varios procesos (en una o varias máquinas con el mismo sistema de archivos) pueden vaciar
+la misma carpeta sin procesar dos veces un archivo:
+    - cada archivo se reclama con un lease de duración limitada
+    - el worker renueva el lease con heartbeats mientras procesa
+    - si un worker cae, su lease expira y otro worker recupera el archivo
+La cola vive en SQLite junto a la bandeja (modo journal clásico, sin WAL, para que
+el bloqueo funcione en sistemas de archivos de red).
+
+Ejemplos:
+    python work_queue.py --folder documents/inbox --workers 4
+    python work_queue.py --folder documents/inbox --workers 8 --dry-run   # prueba local sin API
+
+En --dry-run la cola se crea en una base de datos temporal (salvo que se indique --db)
+y los archivos no se mueven, así que la bandeja queda intacta.
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Añadir src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+SUPPORTED_EXTENSIONS = ['.pdf', '.docx', '.pptx', '.png', '.jpg', '.jpeg', '.avif']
+
+
+class LeaseQueue:
+    """Cola de archivos con leases, heartbeats y reintentos, respaldada por SQLite"""
+
+    def __init__(self, db_path: str, lease_seconds: float = 120, max_attempts: int = 3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.init_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: las transacciones se abren explícitamente con BEGIN IMMEDIATE
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def init_database(self):
+        """Inicializa la base de datos"""
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS work_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result_file TEXT,
+                last_error TEXT,
+                enqueued_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                UNIQUE (file_name, size, mtime)
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_work_items_status ON work_items (status, lease_expires)")
+        conn.close()
+
+    def enqueue_folder(self, folder: str) -> int:
+        """
+        Añade a la cola los archivos soportados de la carpeta (idempotente entre workers).
+        Se guarda el nombre relativo a la bandeja, porque cada máquina puede montarla en otra ruta.
+        """
+        now = time.time()
+        rows = []
+        for file_path in Path(folder).iterdir():
+            if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_EXTENSIONS:
+                try:
+                    stat = file_path.stat()
+                except FileNotFoundError:
+                    continue  # otro worker lo acaba de mover
+                rows.append((file_path.name, stat.st_size, stat.st_mtime, now, now))
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        before = conn.total_changes
+        conn.executemany('''
+            INSERT OR IGNORE INTO work_items (file_name, size, mtime, enqueued_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        added = conn.total_changes - before
+        conn.execute("COMMIT")
+        conn.close()
+        return added
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Reclama el siguiente archivo pendiente o con lease expirado.
+        Devuelve el elemento con su 'token' (número de intento), que protege las operaciones
+        posteriores frente a un worker que haya perdido el lease.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+
+        # Los leases expirados sin intentos restantes pasan a 'failed'
+        conn.execute('''
+            UPDATE work_items SET status = 'failed', owner = NULL, updated_at = ?,
+                   last_error = COALESCE(last_error, 'lease expirado')
+            WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?
+        ''', (now, now, self.max_attempts))
+
+        row = conn.execute('''
+            SELECT id, file_name, attempts FROM work_items
+            WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)
+            ORDER BY id LIMIT 1
+        ''', (now,)).fetchone()
+
+        if row is None:
+            conn.execute("COMMIT")
+            conn.close()
+            return None
+
+        item_id, file_name, attempts = row
+        conn.execute('''
+            UPDATE work_items SET status = 'leased', owner = ?, lease_expires = ?,
+                   attempts = attempts + 1, updated_at = ?
+            WHERE id = ?
+        ''', (worker_id, now + self.lease_seconds, now, item_id))
+        conn.execute("COMMIT")
+        conn.close()
+
+        return {"id": item_id, "file_name": file_name, "owner": worker_id, "token": attempts + 1}
+
+    def _update_owned(self, item: Dict[str, Any], sql: str, params: tuple) -> bool:
+        """Ejecuta una actualización solo si el worker sigue siendo dueño del lease"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.execute(
+            sql + " WHERE id = ? AND owner = ? AND attempts = ? AND status = 'leased'",
+            params + (item["id"], item["owner"], item["token"]),
+        )
+        conn.execute("COMMIT")
+        conn.close()
+        return cursor.rowcount == 1
+
+    def heartbeat(self, item: Dict[str, Any]) -> bool:
+        """Renueva el lease; devuelve False si se ha perdido"""
+        now = time.time()
+        return self._update_owned(item, "UPDATE work_items SET lease_expires = ?, updated_at = ?",
+                                  (now + self.lease_seconds, now))
+
+    def complete(self, item: Dict[str, Any], result_file: Optional[str] = None) -> bool:
+        """Marca el archivo como procesado; devuelve False si el lease ya no era nuestro"""
+        return self._update_owned(item, "UPDATE work_items SET status = 'done', result_file = ?, updated_at = ?",
+                                  (result_file, time.time()))
+
+    def fail(self, item: Dict[str, Any], error: str) -> bool:
+        """Devuelve el archivo a la cola, o lo marca como fallido si agotó sus intentos"""
+        status = "failed" if item["token"] >= self.max_attempts else "pending"
+        return self._update_owned(item, "UPDATE work_items SET status = ?, owner = NULL, last_error = ?, updated_at = ?",
+                                  (status, error, time.time()))
+
+    def stats(self) -> Dict[str, int]:
+        """Número de elementos por estado y reintentos"""
+        conn = self._connect()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM work_items GROUP BY status").fetchall())
+        retried = conn.execute("SELECT COUNT(*) FROM work_items WHERE attempts > 1").fetchone()[0]
+        conn.close()
+        return {
+            "pending": counts.get("pending", 0),
+            "leased": counts.get("leased", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "retried": retried,
+        }
+
+
+class LeaseHeartbeat:
+    """Hilo que renueva el lease de un elemento mientras se procesa"""
+
+    def __init__(self, queue: LeaseQueue, item: Dict[str, Any]):
+        self.queue = queue
+        self.item = item
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        interval = self.queue.lease_seconds / 3
+        retry_interval = max(0.5, interval / 10)
+        renewed_at = time.time()
+        wait = interval
+
+        while not self._stop.wait(wait):
+            attempt_at = time.time()
+            try:
+                renewed = self.queue.heartbeat(self.item)
+            except (sqlite3.Error, OSError) as e:
+                # Base de datos bloqueada o recurso compartido inaccesible: reintentar mientras
+                # el lease siga vigente; si expira antes del siguiente intento, se da por perdido
+                if time.time() + retry_interval >= renewed_at + self.queue.lease_seconds:
+                    print(f"⚠️ No se pudo renovar el lease de {self.item['file_name']}: {e}")
+                    self.lost = True
+                    return
+                wait = retry_interval
+                continue
+
+            if not renewed:
+                self.lost = True
+                return
+            renewed_at = attempt_at
+            wait = interval
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def process_item(processor, file_path: Path, dry_run_seconds: Optional[float] = None) -> Optional[str]:
+    """Procesa un archivo y devuelve la ruta del resultado (None si el OCR no devolvió respuesta)"""
+    if dry_run_seconds is not None:
+        time.sleep(dry_run_seconds)
+        return f"dry-run:{file_path.name}"
+
+    response = processor.process_local_file(str(file_path))
+    if not response:
+        return None
+    return str(processor.save_results(response, f"{file_path.stem}_ocr.json"))
+
+
+def run_worker(folder: str, db_path: Optional[str] = None, worker_id: Optional[str] = None,
+               lease_seconds: float = 120, max_attempts: int = 3, poll_seconds: float = 5,
+               exit_when_empty: bool = True, dry_run_seconds: Optional[float] = None) -> Dict[str, int]:
+    """
+    Bucle de un worker: reclama, procesa, confirma y mueve archivos hasta vaciar la bandeja.
+    Con exit_when_empty solo termina cuando no quedan archivos pendientes ni con lease activo.
+    En modo simulado (dry_run_seconds) hace falta una base de datos aparte y los archivos no se mueven,
+    para no marcar como procesada la bandeja real.
+    """
+    dry_run = dry_run_seconds is not None
+    if dry_run and db_path is None:
+        raise ValueError("El modo simulado necesita una base de datos propia (db_path)")
+
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    queue = LeaseQueue(db_path or str(Path(folder) / ".work_queue.db"), lease_seconds, max_attempts)
+    processed_folder = Path(folder) / "processed"
+    if not dry_run:
+        processed_folder.mkdir(exist_ok=True)
+
+    processor = None
+    if not dry_run:
+        from src.ocr_processor import MistralOCRProcessor
+        processor = MistralOCRProcessor()
+
+    summary = {"processed": 0, "failed": 0, "lost_leases": 0}
+    last_scan = 0.0
+
+    while True:
+        if time.time() - last_scan >= poll_seconds:
+            queue.enqueue_folder(folder)
+            last_scan = time.time()
+
+        item = queue.claim(worker_id)
+
+        if item is None:
+            # Con leases de otros workers aún vigentes se sigue esperando: si alguno se cae,
+            # su archivo se recupera en esta misma ejecución al expirar el lease
+            if exit_when_empty and queue.stats()["leased"] == 0:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        file_name = item["file_name"]
+        file_path = Path(folder) / file_name
+        try:
+            with LeaseHeartbeat(queue, item) as heartbeat:
+                result_file = process_item(processor, file_path, dry_run_seconds)
+        except Exception as e:
+            print(f"❌ [{worker_id}] Error procesando {file_name}: {e}")
+            queue.fail(item, str(e))
+            summary["failed"] += 1
+            continue
+
+        if heartbeat.lost or not result_file:
+            if heartbeat.lost:
+                print(f"⚠️ [{worker_id}] Lease perdido para {file_name}; se descarta el resultado")
+                summary["lost_leases"] += 1
+            else:
+                queue.fail(item, "No response from API")
+                summary["failed"] += 1
+            continue
+
+        if queue.complete(item, result_file):
+            if not dry_run:
+                try:
+                    file_path.rename(processed_folder / file_name)
+                except OSError as e:
+                    # El resultado ya está confirmado; el archivo no se vuelve a encolar aunque siga en la bandeja
+                    print(f"⚠️ [{worker_id}] No se pudo mover {file_name} a processed/: {e}")
+            summary["processed"] += 1
+            print(f"✅ [{worker_id}] {file_name}")
+        else:
+            summary["lost_leases"] += 1
+
+    return summary
+
+
+def _worker_entry(kwargs: Dict[str, Any]) -> Dict[str, int]:
+    return run_worker(**kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Workers de OCR con leases sobre una bandeja compartida')
+    parser.add_argument('--folder', '-f', required=True, help='Bandeja de entrada compartida')
+    parser.add_argument('--db', default=None, help='Base de datos de la cola (por defecto <folder>/.work_queue.db)')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='Procesos worker en esta máquina')
+    parser.add_argument('--lease-seconds', type=float, default=120, help='Duración del lease')
+    parser.add_argument('--max-attempts', type=int, default=3, help='Intentos por archivo antes de marcarlo fallido')
+    parser.add_argument('--watch', action='store_true', help='Seguir esperando archivos nuevos en lugar de salir')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Simular el OCR (sin llamar al API, con una cola temporal y sin mover archivos)')
+    parser.add_argument('--dry-run-seconds', type=float, default=0.2, help='Duración simulada de cada OCR')
+
+    args = parser.parse_args()
+
+    db_path = args.db
+    scratch_dir = None
+    if args.dry_run and db_path is None:
+        scratch_dir = tempfile.TemporaryDirectory(prefix="work_queue_dry_run_")
+        db_path = str(Path(scratch_dir.name) / "work_queue.db")
+        print(f"🧪 Simulación: cola temporal en {db_path}; los archivos no se moverán")
+
+    worker_kwargs = {
+        "folder": args.folder,
+        "db_path": db_path,
+        "lease_seconds": args.lease_seconds,
+        "max_attempts": args.max_attempts,
+        "exit_when_empty": not args.watch,
+        "dry_run_seconds": args.dry_run_seconds if args.dry_run else None,
+    }
+
+    start_time = time.time()
+    if args.workers == 1:
+        summaries = [run_worker(**worker_kwargs)]
+    else:
+        with multiprocessing.Pool(args.workers) as pool:
+            summaries = pool.map(_worker_entry, [worker_kwargs] * args.workers)
+
+    queue = LeaseQueue(db_path or str(Path(args.folder) / ".work_queue.db"))
+    print(f"\n📊 Resumen ({time.time() - start_time:.1f}s):")
+    print(f"  📄 Procesados en esta máquina: {sum(s['processed'] for s in summaries)}")
+    print(f"  ❌ Errores: {sum(s['failed'] for s in summaries)}")
+    print(f"  ⚠️ Leases perdidos: {sum(s['lost_leases'] for s in summaries)}")
+    print(f"  🗂️ Estado de la cola: {queue.stats()}")
+
+    if scratch_dir:
+        scratch_dir.cleanup()